@@ -1,5 +1,17 @@
+import os
+import pickle
+import shutil
+import tempfile
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
 import hdbscan
 
+from pipeline.preprocessing import fit_scaling, apply_scaling
+
 def cluster_df(df_scale, df):
     '''
     This function performs the clustering on the dataframe df through the scaled data
@@ -18,4 +30,237 @@ def cluster_df(df_scale, df):
     cls = clusterer.fit(df_scale)
     df['cluster_id']=cls.labels_
     
-    return cls, df
\ No newline at end of file
+    return cls, df
+
+class ClusterModel:
+    '''
+    Persistable HDBSCAN model that assigns new plays to the clusters found at fit time
+    without refitting (and therefore without renumbering the existing clusters).
+
+    The model stores the scaling fit on the training plays (StandardScaler and LabelEncoders,
+    see fit_scaling) and applies it to new plays, so fit and predict both take the unscaled
+    table, i.e. the second output of preprocess_ep/preprocess_fg.
+
+    Parameters:
+    -----------
+    noise_tol - allowed increase in the fraction of noise points of a new batch over the
+                training noise fraction before drift is flagged
+    strength_tol - allowed drop in mean membership strength of a new batch below the
+                   training mean strength before drift is flagged
+    **hdbscan_kwargs - passed through to hdbscan.HDBSCAN (prediction_data is always on)
+    '''
+
+    def __init__(self, noise_tol=0.1, strength_tol=0.15, **hdbscan_kwargs):
+        self.noise_tol = noise_tol
+        self.strength_tol = strength_tol
+        self.hdbscan_kwargs = hdbscan_kwargs
+        self.clusterer = None
+        self.scale = None
+        self.encoders = None
+        self.columns = None
+        self.baseline_noise = None
+        self.baseline_strength = None
+
+    def fit(self, pt_df):
+        '''
+        Fit the scaling and the clusterer (with prediction data enabled) and record the
+        baseline noise fraction and membership strength used for drift detection.
+
+        Parameters:
+        -----------
+        pt_df - truncated play dataframe without the scaling (second output of preprocess_ep/preprocess_fg)
+
+        Returns:
+        --------
+        self
+        '''
+        self.columns = list(pt_df.columns)
+        self.scale, self.encoders = fit_scaling(pt_df)
+
+        clusterer = hdbscan.HDBSCAN(prediction_data=True, **self.hdbscan_kwargs)
+        self.clusterer = clusterer.fit(self.transform(pt_df))
+
+        labels = self.clusterer.labels_
+        self.baseline_noise = float(np.mean(labels == -1))
+        self.baseline_strength = float(np.mean(self.clusterer.probabilities_[labels != -1])) if (labels != -1).any() else 0.0
+
+        return self
+
+    def transform(self, pt_df):
+        '''
+        Scale and encode plays with the statistics stored at fit time.
+
+        Parameters:
+        -----------
+        pt_df - truncated play dataframe without the scaling, with the training columns
+
+        Returns:
+        --------
+        points - float64 array of scaled features in the training column order
+        '''
+        if self.scale is None:
+            raise ValueError('ClusterModel must be fit before transforming')
+
+        missing = [col for col in self.columns if col not in pt_df.columns]
+        if missing:
+            raise ValueError(f'New plays are missing clustering columns: {missing}')
+
+        pt_scale = apply_scaling(pt_df[self.columns], self.scale, self.encoders)
+
+        return np.asarray(pt_scale, dtype=np.float64)
+
+    def predict(self, pt_df):
+        '''
+        Assign new plays to the fitted clusters using approximate prediction.
+
+        Parameters:
+        -----------
+        pt_df - truncated play dataframe without the scaling for the new plays
+
+        Returns:
+        --------
+        labels - cluster label per play (-1 for noise)
+        strengths - membership strength of each play in its assigned cluster
+        '''
+        if self.clusterer is None:
+            raise ValueError('ClusterModel must be fit before predicting')
+
+        labels, strengths = hdbscan.approximate_predict(self.clusterer, self.transform(pt_df))
+
+        return labels, strengths
+
+    def assign(self, pt_df):
+        '''
+        Predict cluster labels for new plays and attach them to the dataframe, mirroring cluster_df.
+
+        Parameters:
+        -----------
+        pt_df - truncated play dataframe without the scaling for the new plays
+
+        Returns:
+        --------
+        pt_df with columns 'cluster_id' and 'cluster_strength'
+        '''
+        labels, strengths = self.predict(pt_df)
+        pt_df['cluster_id'] = labels
+        pt_df['cluster_strength'] = strengths
+
+        return pt_df
+
+    def drift(self, pt_df):
+        '''
+        Compare a batch of new plays against the training baseline to decide if a full refit
+        is needed.
+
+        Parameters:
+        -----------
+        pt_df - truncated play dataframe without the scaling for the new plays
+
+        Returns:
+        --------
+        report - dict with batch and baseline noise fraction and mean strength, and
+                 'refit' set to True when either tolerance is exceeded
+        '''
+        labels, strengths = self.predict(pt_df)
+
+        noise = float(np.mean(labels == -1)) if len(labels) else 0.0
+        strength = float(np.mean(strengths[labels != -1])) if (labels != -1).any() else 0.0
+
+        refit = (noise - self.baseline_noise > self.noise_tol) or (self.baseline_strength - strength > self.strength_tol)
+
+        return {
+            'noise_fraction': noise,
+            'baseline_noise_fraction': self.baseline_noise,
+            'mean_strength': strength,
+            'baseline_mean_strength': self.baseline_strength,
+            'refit': bool(refit),
+        }
+
+    def save(self, path):
+        # Persist the fitted model (scaling and clusterer with its prediction data) to disk
+        with open(path, 'wb') as f:
+            pickle.dump(self, f)
+
+    @staticmethod
+    def load(path):
+        # Load a model previously written with save
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+def _sweep_min_samples(points, min_samples, min_cluster_sizes, cache_dir):
+    '''
+    Fit one HDBSCAN per min_cluster_size for a fixed min_samples. All fits share the
+    joblib cache in cache_dir, so the nearest-neighbor/core-distance and spanning tree
+    computation runs once and only the cluster extraction is repeated.
+    '''
+    rows = []
+
+    for min_cluster_size in min_cluster_sizes:
+        start = time.perf_counter()
+        cls = hdbscan.HDBSCAN(min_cluster_size=min_cluster_size, min_samples=min_samples,
+                              gen_min_span_tree=True, memory=cache_dir).fit(points)
+        fit_time = time.perf_counter() - start
+
+        labels = cls.labels_
+        persistence = cls.cluster_persistence_
+
+        rows.append({
+            'min_cluster_size': min_cluster_size,
+            'min_samples': min_samples,
+            'n_clusters': int(labels.max() + 1),
+            'noise_fraction': float(np.mean(labels == -1)),
+            'relative_validity': float(cls.relative_validity_) if labels.max() >= 0 else np.nan,
+            'mean_persistence': float(np.mean(persistence)) if len(persistence) else np.nan,
+            'fit_time': fit_time,
+        })
+
+    return rows
+
+def cluster_param_sweep(df_scale, min_cluster_sizes, min_samples_list, n_jobs=None, cache_dir=None):
+    '''
+    Evaluate a grid of HDBSCAN parameters on the output of preprocess_ep/preprocess_fg.
+
+    Configurations are grouped by min_samples and each group runs in its own worker
+    process; within a group the core distances and spanning tree are cached and reused,
+    so varying min_cluster_size only repeats the (cheap) cluster extraction.
+
+    Parameters:
+    -----------
+    df_scale - the scaled dataframe (or array) produced by preprocess_ep/preprocess_fg
+    min_cluster_sizes - iterable of min_cluster_size values to try
+    min_samples_list - iterable of min_samples values to try
+    n_jobs - number of worker processes, default is one per min_samples value (capped at cpu count)
+    cache_dir - directory for the shared joblib cache, a temporary one is used (and removed) if None
+
+    Returns:
+    --------
+    sweep_df - dataframe with one row per configuration: 'min_cluster_size', 'min_samples',
+               'n_clusters', 'noise_fraction', 'relative_validity', 'mean_persistence', 'fit_time'
+    '''
+    points = np.asarray(df_scale, dtype=np.float64)
+    min_cluster_sizes = list(min_cluster_sizes)
+    min_samples_list = list(min_samples_list)
+
+    tmp_dir = None
+    if cache_dir is None:
+        tmp_dir = tempfile.mkdtemp(prefix='hdbscan_sweep_')
+        cache_dir = tmp_dir
+
+    if n_jobs is None:
+        n_jobs = min(len(min_samples_list), os.cpu_count() or 1)
+
+    rows = []
+    try:
+        with ProcessPoolExecutor(max_workers=max(n_jobs, 1)) as pool:
+            futures = [pool.submit(_sweep_min_samples, points, min_samples, min_cluster_sizes, cache_dir)
+                       for min_samples in min_samples_list]
+            for future in futures:
+                rows.extend(future.result())
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    sweep_df = pd.DataFrame(rows)
+    sweep_df = sweep_df.sort_values(['min_samples', 'min_cluster_size'], ignore_index=True)
+
+    return sweep_df
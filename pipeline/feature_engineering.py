@@ -2,6 +2,8 @@ import pandas as pd
 import numpy as np 
 
 from querying.tracking_query import get_play, get_event
+from querying.spatial_query import build_frame_blocks, reference_slots, opponent_team, HOME, AWAY
+from pipeline.schema import concat_frames
 
 def get_game_season(game_id, games):
     return games[games['gameId']==game_id]['season'].values[0]
@@ -113,6 +115,10 @@ def find_kickline(game_id, play_id, track_fp, event):
     y1 = event_df['y'][event_index]
     x2 = event_df['x'][event_index+2]
     y2 = event_df['y'][event_index+2]
+
+    #ball has not moved downfield between the two frames, no line to extrapolate
+    if x2 == x1:
+        return np.nan
     
     m = (y2-y1)/(x2-x1)
     
@@ -133,6 +139,10 @@ def endzone_y_expected(pt_play, track_fp, event):
     --------
     pt_play - play dataframe for desired play type with computed endzone y-position column
 
+    kick_trajectory writes the same column from a least-squares fit to the post-kick frames of
+    all plays at once (and adds curvature/residual features); this two-point version is kept
+    for reproducing the original results.
+
     '''
     pt_play['endzone_y_expected'] = pt_play.index.map(
         lambda x: find_kickline(
@@ -144,6 +154,147 @@ def endzone_y_expected(pt_play, track_fp, event):
 
     return pt_play
 
+def kick_frame_ids(track_fp, event, window=5):
+    '''
+    Frame of the kick for every play at once: the frame of maximum ball speed within
+    window frames of the labelled event (the same rule as get_event).
+
+    Parameters:
+    -----------
+    track_fp - football-specific tracking dataframe for play type
+    event - string of the event that we want to find, i.e., 'extra_point_attempt'
+    window - number of frames either side of the event to search
+
+    Returns:
+    --------
+    kick_frames - series of kick frameId indexed by (gameId, playId)
+    '''
+    event_frames = track_fp[track_fp['event'] == event].groupby(['gameId', 'playId'])['frameId'].min().rename('event_frame')
+
+    ball = track_fp[['gameId', 'playId', 'frameId', 's']].join(event_frames, on=['gameId', 'playId'], how='inner')
+    ball = ball[(ball['frameId'] - ball['event_frame']).abs() <= window]
+
+    max_speed = ball.loc[ball.groupby(['gameId', 'playId'])['s'].idxmax()]
+
+    return max_speed.set_index(['gameId', 'playId'])['frameId'].rename('kick_frame')
+
+def _batched_lstsq(design, values):
+    # Least-squares coefficients per play from the batched normal equations,
+    # pinv keeps rank-deficient (too few frames) plays finite
+    design_t = design.transpose(0, 2, 1)
+    return (np.linalg.pinv(design_t @ design) @ (design_t @ values[:, :, None]))[:, :, 0]
+
+def fit_kick_trajectories(track_fp, event, n_frames=6, degree=2, x_line=120):
+    '''
+    Fit the post-kick flight of the ball for every play at once with stacked least squares.
+
+    The ball's x and y are fit as lines in time using the kick frame and the n_frames frames
+    after it, and the projected crossing of x_line is where the x fit reaches it (so no division
+    by a zero x-step can occur). The straight-line projection is the expected path that
+    endzone_y_error measures the kick against; it is also far more stable than extrapolating a
+    polynomial fit to ~0.6s of flight over the 1-3s to the uprights. y is additionally fit as a
+    polynomial of the given degree in time for the hook/slice curvature and the fit residual.
+
+    Parameters:
+    -----------
+    track_fp - football-specific tracking dataframe for play type
+    event - string of the event that we want to find, i.e., 'extra_point_attempt'
+    n_frames - number of frames after the kick frame used in the fit
+    degree - degree of the y(t) fit used for 'kick_curvature' and 'kick_fit_residual', 2 to capture hook/slice
+    x_line - x-coordinate of the line to project to (the fieldgoal line at x=120)
+
+    Returns:
+    --------
+    fits - dataframe indexed by (gameId, playId) with columns
+           'endzone_y_expected' - straight-line projected y at x_line (NaN if the ball is not moving downfield)
+           'kick_fit_residual' - RMS distance of the tracked positions from the fitted (degree) path
+           'kick_curvature' - d2y/dx2 of the fitted path (0 for degree 1)
+           'kick_fit_frames' - number of frames used in the fit
+    '''
+    kick_frames = kick_frame_ids(track_fp, event)
+
+    ball = track_fp[['gameId', 'playId', 'frameId', 'x', 'y']].join(kick_frames, on=['gameId', 'playId'], how='inner')
+    ball['offset'] = ball['frameId'] - ball['kick_frame']
+    ball = ball[(ball['offset'] >= 0) & (ball['offset'] <= n_frames)]
+
+    plays = kick_frames.index
+    play_idx = plays.get_indexer(pd.MultiIndex.from_frame(ball[['gameId', 'playId']]))
+    offset = ball['offset'].to_numpy()
+
+    # Stack the post-kick frames of every play into (plays, frames) arrays
+    n_plays, n_points = len(plays), n_frames + 1
+    mask = np.zeros((n_plays, n_points), dtype=bool)
+    x = np.zeros((n_plays, n_points))
+    y = np.zeros((n_plays, n_points))
+    mask[play_idx, offset] = True
+    x[play_idx, offset] = ball['x'].to_numpy(dtype=np.float64)
+    y[play_idx, offset] = ball['y'].to_numpy(dtype=np.float64)
+
+    # Time in seconds since the kick (frames are 0.1s apart), masked rows are zeroed out
+    t = np.arange(n_points) / 10
+    design = np.stack([t**p for p in range(degree + 1)], axis=1)
+    design = np.where(mask[:, :, None], design[None, :, :], 0)
+
+    line = design[:, :, :2]
+    coef_x = _batched_lstsq(line, x)
+    coef_y_line = _batched_lstsq(line, y)
+    coef_y = _batched_lstsq(design, y)
+
+    n_fit = mask.sum(axis=1)
+    vx = coef_x[:, 1]
+
+    # Time at which the ball reaches x_line, only for balls moving downfield
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t_cross = np.where(vx > 0, (x_line - coef_x[:, 0]) / vx, np.nan)
+        curvature = 2 * coef_y[:, 2] / vx**2 if degree >= 2 else np.zeros(n_plays)
+
+    endzone_y = coef_y_line[:, 0] + coef_y_line[:, 1] * t_cross
+
+    fit_x = line @ coef_x[:, :, None]
+    fit_y = design @ coef_y[:, :, None]
+    sq_err = np.where(mask, (x - fit_x[:, :, 0])**2 + (y - fit_y[:, :, 0])**2, 0)
+    residual = np.sqrt(sq_err.sum(axis=1) / np.maximum(n_fit, 1))
+
+    # Not enough frames to determine the fits
+    underdetermined = n_fit < degree + 1
+    endzone_y[n_fit < 2] = np.nan
+    residual[underdetermined] = np.nan
+    curvature = np.where(underdetermined | (vx <= 0), np.nan, curvature)
+
+    fits = pd.DataFrame({
+        'endzone_y_expected': endzone_y,
+        'kick_fit_residual': residual,
+        'kick_curvature': curvature,
+        'kick_fit_frames': n_fit,
+    }, index=plays)
+
+    return fits
+
+def kick_trajectory(pt_play, track_fp, event, n_frames=6, degree=2):
+    ''' 
+    Batch replacement for endzone_y_expected: writes 'endzone_y_expected' from the least-squares
+    straight-line fit of every play (so endzone_y_error uses the fit), plus the hook/slice features.
+
+    Paramters:
+    ----------
+    pt_play - play dataframe for desired play type
+    track_fp - football tracking dataframe for desired play type
+    event - string of the event that we want to find, i.e., 'extra_point_attempt'
+    n_frames, degree - passed to fit_kick_trajectories
+    
+    Returns:
+    --------
+    pt_play - play dataframe with columns 'endzone_y_expected', 'kick_fit_residual', 'kick_curvature'
+
+    '''
+    fits = fit_kick_trajectories(track_fp, event, n_frames=n_frames, degree=degree)
+    fits = fits.drop(columns=['kick_fit_frames'])
+
+    pt_play = pt_play.drop(columns=[col for col in fits.columns if col in pt_play.columns])
+    pt_play = pt_play.join(fits, on=['gameId', 'playId'])
+
+    return pt_play
+
 def endzone_y_error(pt_play):
     ''' 
     The difference between the expected y-position of ball as it crosses fieldgoal line and the actual y-position
@@ -263,7 +414,7 @@ def kicker_core_dist(pt_play, track_pt18, track_pt19, track_pt20, track_fp, even
 
     '''
     
-    tracking = pd.concat([track_pt18, track_pt19, track_pt20])
+    tracking = concat_frames([track_pt18, track_pt19, track_pt20])
 
     pt_play[f'kicker_core_dist_{k}'] = pt_play.index.map(
         lambda x: compute_kicker_core_dist(
@@ -276,4 +427,136 @@ def kicker_core_dist(pt_play, track_pt18, track_pt19, track_pt20, track_fp, even
         )
     )
 
-    return pt_play
\ No newline at end of file
+    return pt_play
+
+def kick_window_kinematics(tracking, track_fp, event, before=10, after=0, ref='kicker'):
+    '''
+    Kinematics of every player in every play over the window of frames around the kick,
+    computed on flat NumPy arrays for all plays at once.
+
+    Parameters:
+    -----------
+    tracking - tracking data (players and football) for the plays of interest
+    track_fp - football-specific tracking dataframe for play type
+    event - string of the event that we want to find, i.e., 'extra_point_attempt'
+    before, after - number of frames before/after the kick frame in the window
+    ref - what players close on: 'kicker' or 'ball'
+
+    Returns:
+    --------
+    kinematics - one row per player per window frame with 'gameId', 'playId', 'nflId',
+                 'frameId', 't' (seconds relative to the kick), 'rusher' (player is on the
+                 team opposing the kicker), 'speed', 'acceleration', 'ref_dist',
+                 'closing_speed' (rate at which ref_dist shrinks) and 'time_to_contact'
+                 (ref_dist / closing_speed, inf when not closing)
+    '''
+    kick_frames = kick_frame_ids(track_fp, event)
+
+    track = tracking[['gameId', 'playId', 'frameId', 'nflId', 'team', 'position', 'x', 'y', 'event']]
+    track = track.join(kick_frames, on=['gameId', 'playId'], how='inner')
+
+    # Two extra leading frames so every window frame has a speed and an acceleration
+    offset = track['frameId'] - track['kick_frame']
+    track = track[(offset >= -before - 2) & (offset <= after)]
+
+    # Reference position and opposing team per frame
+    blocks = build_frame_blocks(track)
+    rows = np.arange(len(blocks))
+    slot = reference_slots(blocks, ref)
+    ref_xy = blocks.xy[rows, np.maximum(slot, 0)].astype(np.float64)
+    ref_xy[slot < 0] = np.nan
+    opp = opponent_team(blocks, ref)
+
+    players = track[track['team'] != 'football'].sort_values(['gameId', 'playId', 'nflId', 'frameId'])
+    frame_keys = pd.MultiIndex.from_frame(blocks.frames[['gameId', 'playId', 'frameId']])
+    frame_idx = frame_keys.get_indexer(pd.MultiIndex.from_frame(players[['gameId', 'playId', 'frameId']]))
+
+    keys = players[['gameId', 'playId', 'nflId']].to_numpy(dtype=np.float64)
+    frame = players['frameId'].to_numpy(dtype=np.float64)
+    x = players['x'].to_numpy(dtype=np.float64)
+    y = players['y'].to_numpy(dtype=np.float64)
+
+    team_values = players['team'].to_numpy(dtype=object)
+    team = np.select([team_values == 'home', team_values == 'away'], [HOME, AWAY], default=-1)
+    rusher = team == opp[frame_idx]
+
+    ref_dist = np.hypot(x - ref_xy[frame_idx, 0], y - ref_xy[frame_idx, 1])
+
+    # Backward differences along each player's frames
+    same_player = np.zeros(len(players), dtype=bool)
+    same_player[1:] = (keys[1:] == keys[:-1]).all(axis=1)
+
+    def backward_diff(values):
+        diff = np.full(len(values), np.nan)
+        diff[1:] = np.diff(values)
+        diff[~same_player] = np.nan
+        return diff
+
+    dt = backward_diff(frame) / 10
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        speed = np.hypot(backward_diff(x), backward_diff(y)) / dt
+        acceleration = backward_diff(speed) / dt
+        closing_speed = -backward_diff(ref_dist) / dt
+        time_to_contact = np.where(closing_speed > 0, ref_dist / closing_speed, np.inf)
+
+    kinematics = pd.DataFrame({
+        'gameId': players['gameId'].to_numpy(),
+        'playId': players['playId'].to_numpy(),
+        'nflId': players['nflId'].to_numpy(),
+        'frameId': players['frameId'].to_numpy(),
+        't': (frame - players['kick_frame'].to_numpy()) / 10,
+        'rusher': rusher,
+        'speed': speed,
+        'acceleration': acceleration,
+        'ref_dist': ref_dist,
+        'closing_speed': closing_speed,
+        'time_to_contact': time_to_contact,
+    })
+
+    # Drop the leading frames that were only needed for the differences
+    kinematics = kinematics[kinematics['t'] >= -before / 10].reset_index(drop=True)
+
+    return kinematics
+
+def rush_features(pt_play, tracking, track_fp, event, before=10, after=0, ref='kicker'):
+    '''
+    Per-play pressure features from the kinematics of the rushing team over the kick window.
+
+    Paramters:
+    ----------
+    pt_play - play dataframe for desired play type (e.g. output of make_field_goal/make_extra_point)
+    tracking - tracking data (players and football) for the play type
+    track_fp - football tracking dataframe for desired play type
+    event - string of the event that we want to find, i.e., 'extra_point_attempt'
+    before, after, ref - passed to kick_window_kinematics
+
+    Returns:
+    --------
+    pt_play - play dataframe with columns
+              'max_rusher_speed', 'max_rusher_acceleration', 'max_rusher_closing_speed',
+              'min_rusher_time_to_contact' - extremes over all rushers and window frames
+              'first_rusher_arrival' - earliest projected time (seconds relative to the kick)
+                                       at which a rusher reaches the reference at his current
+                                       closing speed
+    '''
+    plays = pd.MultiIndex.from_frame(pt_play[['gameId', 'playId']])
+    in_plays = pd.MultiIndex.from_frame(tracking[['gameId', 'playId']]).isin(plays)
+
+    kinematics = kick_window_kinematics(tracking[in_plays], track_fp, event, before=before, after=after, ref=ref)
+    rushers = kinematics[kinematics['rusher']].copy()
+    rushers['arrival'] = rushers['t'] + rushers['time_to_contact']
+
+    grouped = rushers.groupby(['gameId', 'playId'])
+    features = pd.DataFrame({
+        'max_rusher_speed': grouped['speed'].max(),
+        'max_rusher_acceleration': grouped['acceleration'].max(),
+        'max_rusher_closing_speed': grouped['closing_speed'].max(),
+        'min_rusher_time_to_contact': grouped['time_to_contact'].min(),
+        'first_rusher_arrival': grouped['arrival'].min(),
+    }).replace(np.inf, np.nan)
+
+    pt_play = pt_play.drop(columns=[col for col in features.columns if col in pt_play.columns])
+    pt_play = pt_play.join(features, on=['gameId', 'playId'])
+
+    return pt_play
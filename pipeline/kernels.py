@@ -0,0 +1,340 @@
+import numpy as np
+import pandas as pd
+
+from pipeline.feature_engineering import kick_frame_ids, x_within_fg_bounds
+
+try:
+    import numba
+except ImportError:
+    # Numba is optional, every kernel has a NumPy implementation
+    numba = None
+
+# Per-play tracking scans run over flat arrays sorted by play, with offsets[i]:offsets[i+1]
+# the rows of play i. Each kernel has a NumPy implementation and, when Numba is installed,
+# a compiled one that loops over plays in parallel. Both return identical output.
+
+def _resolve_backend(backend):
+    if backend is None:
+        return 'numba' if numba is not None else 'numpy'
+    if backend == 'numba' and numba is None:
+        raise ImportError('The numba backend requires numba to be installed')
+    if backend not in ('numba', 'numpy'):
+        raise ValueError(f"Unknown backend '{backend}', use 'numba' or 'numpy'")
+    return backend
+
+def _segment_starts(mask, offsets):
+    # Number of True values in each segment and index (into flatnonzero(mask)) of the first one
+    # (a cumulative count, reduceat fails on empty segments at the end)
+    before = np.concatenate([[0], np.cumsum(mask, dtype=np.int64)])
+    counts = before[offsets[1:]] - before[offsets[:-1]]
+    first = before[offsets[:-1]]
+    return counts, first
+
+# #### NumPy implementations
+
+def _endzone_y_numpy(x, y, offsets):
+    within = x_within_fg_bounds(x)
+    counts, first = _segment_starts(within, offsets)
+    within_pos = np.flatnonzero(within)
+
+    # Middle pair of in-bounds frames, negative positions wrap like iloc (only when n == 1)
+    id1 = counts // 2 - 1
+    id2 = np.where(counts % 2 == 0, counts // 2, counts // 2 - 1)
+    id1 = np.where(id1 < 0, id1 + counts, id1)
+    id2 = np.where(id2 < 0, id2 + counts, id2)
+
+    found = counts > 0
+    mean_y = np.full(len(counts), np.nan)
+    mean_y[found] = (y[within_pos[first[found] + id1[found]]] + y[within_pos[first[found] + id2[found]]]) / 2
+
+    return mean_y
+
+def _idx_diff_numpy(is_event, s, offsets):
+    n_plays = len(offsets) - 1
+    rows = np.arange(len(s))
+    play_of = np.repeat(np.arange(n_plays), np.diff(offsets))
+
+    idx_diff = np.full(n_plays, np.nan)
+    non_empty = offsets[:-1] < offsets[1:]
+    if not non_empty.any():
+        return idx_diff
+
+    starts = offsets[:-1][non_empty]
+    big = len(s)
+
+    event_idx = np.minimum.reduceat(np.where(is_event, rows, big), starts)
+
+    # First occurrence of the (NaN-skipping) maximum speed, as in Series.idxmax
+    max_s = np.fmax.reduceat(s, starts)
+    max_rep = np.full(n_plays, np.nan)
+    max_rep[non_empty] = max_s
+    at_max = s == max_rep[play_of]
+    max_idx = np.minimum.reduceat(np.where(at_max, rows, big), starts)
+
+    valid = (event_idx < big) & (max_idx < big)
+    diff = np.where(valid, np.abs(event_idx - max_idx), np.nan)
+    idx_diff[non_empty] = diff
+
+    return idx_diff
+
+def _kth_smallest_numpy(values, offsets, k):
+    n_plays = len(offsets) - 1
+    play_of = np.repeat(np.arange(n_plays), np.diff(offsets))
+
+    # Sort values within each segment, NaN last
+    order = np.lexsort((values, play_of))
+    sorted_values = values[order]
+
+    kth = np.full(n_plays, np.nan)
+    has_k = np.diff(offsets) >= k
+    kth[has_k] = sorted_values[offsets[:-1][has_k] + k - 1]
+
+    return kth
+
+# #### Numba implementations
+
+if numba is not None:
+
+    @numba.njit(parallel=True, cache=True)
+    def _endzone_y_numba(x, y, offsets):
+        n_plays = len(offsets) - 1
+        mean_y = np.full(n_plays, np.nan)
+
+        for i in numba.prange(n_plays):
+            start, stop = offsets[i], offsets[i + 1]
+
+            n = 0
+            for j in range(start, stop):
+                if (118 < x[j] < 122) or (-2 < x[j] < 2):
+                    n += 1
+            if n == 0:
+                continue
+
+            id1 = n // 2 - 1
+            id2 = n // 2 if n % 2 == 0 else n // 2 - 1
+            if id1 < 0:
+                id1 += n
+            if id2 < 0:
+                id2 += n
+
+            rank = 0
+            first_y = np.nan
+            last_y = np.nan
+            for j in range(start, stop):
+                if (118 < x[j] < 122) or (-2 < x[j] < 2):
+                    if rank == id1:
+                        first_y = y[j]
+                    if rank == id2:
+                        last_y = y[j]
+                    rank += 1
+
+            mean_y[i] = (first_y + last_y) / 2
+
+        return mean_y
+
+    @numba.njit(parallel=True, cache=True)
+    def _idx_diff_numba(is_event, s, offsets):
+        n_plays = len(offsets) - 1
+        idx_diff = np.full(n_plays, np.nan)
+
+        for i in numba.prange(n_plays):
+            event_idx = -1
+            max_idx = -1
+            max_s = -np.inf
+
+            for j in range(offsets[i], offsets[i + 1]):
+                if event_idx < 0 and is_event[j]:
+                    event_idx = j
+                if not np.isnan(s[j]) and (max_idx < 0 or s[j] > max_s):
+                    max_s = s[j]
+                    max_idx = j
+
+            if event_idx >= 0 and max_idx >= 0:
+                idx_diff[i] = abs(event_idx - max_idx)
+
+        return idx_diff
+
+    @numba.njit(parallel=True, cache=True)
+    def _kth_smallest_numba(values, offsets, k):
+        n_plays = len(offsets) - 1
+        kth = np.full(n_plays, np.nan)
+
+        for i in numba.prange(n_plays):
+            start, stop = offsets[i], offsets[i + 1]
+            if stop - start >= k:
+                # np.sort places NaN last, matching the NumPy implementation
+                kth[i] = np.sort(values[start:stop])[k - 1]
+
+        return kth
+
+# #### Kernels
+
+def endzone_y_kernel(x, y, offsets, backend=None):
+    '''
+    Mean y of the middle pair of frames within the fieldgoal x-boundaries for every play
+    (the inner logic of compute_endzone_y_pos).
+
+    Parameters:
+    -----------
+    x, y - ball coordinates sorted by play (and frame within play)
+    offsets - int64 array of length n_plays + 1 with the start row of each play
+    backend - 'numba', 'numpy' or None to use numba when it is installed
+
+    Returns:
+    --------
+    mean_y - array of endzone y per play, NaN when the ball never reaches the fieldgoal
+    '''
+    x = np.ascontiguousarray(x, dtype=np.float64)
+    y = np.ascontiguousarray(y, dtype=np.float64)
+    offsets = np.ascontiguousarray(offsets, dtype=np.int64)
+
+    if _resolve_backend(backend) == 'numba':
+        return _endzone_y_numba(x, y, offsets)
+    return _endzone_y_numpy(x, y, offsets)
+
+def idx_diff_kernel(is_event, s, offsets, backend=None):
+    '''
+    Row distance between the first labelled event and the first maximum of the ball speed for
+    every play (the inner logic of get_kick_attempt_idx_diff).
+
+    Parameters:
+    -----------
+    is_event - boolean array, True on rows labelled with the event
+    s - ball speed sorted by play (and frame within play)
+    offsets - int64 array of length n_plays + 1 with the start row of each play
+    backend - 'numba', 'numpy' or None to use numba when it is installed
+
+    Returns:
+    --------
+    idx_diff - array of index differences per play, NaN when the event is missing
+    '''
+    is_event = np.ascontiguousarray(is_event, dtype=np.bool_)
+    s = np.ascontiguousarray(s, dtype=np.float64)
+    offsets = np.ascontiguousarray(offsets, dtype=np.int64)
+
+    if _resolve_backend(backend) == 'numba':
+        return _idx_diff_numba(is_event, s, offsets)
+    return _idx_diff_numpy(is_event, s, offsets)
+
+def kth_smallest_kernel(values, offsets, k, backend=None):
+    '''
+    k-th smallest value of every segment (the core distance in compute_kicker_core_dist).
+
+    Parameters:
+    -----------
+    values - values grouped by segment
+    offsets - int64 array of length n_segments + 1 with the start row of each segment
+    k - rank to return (1 is the smallest)
+    backend - 'numba', 'numpy' or None to use numba when it is installed
+
+    Returns:
+    --------
+    kth - array of the k-th smallest value per segment, NaN for segments with fewer than k values
+    '''
+    values = np.ascontiguousarray(values, dtype=np.float64)
+    offsets = np.ascontiguousarray(offsets, dtype=np.int64)
+
+    if _resolve_backend(backend) == 'numba':
+        return _kth_smallest_numba(values, offsets, k)
+    return _kth_smallest_numpy(values, offsets, k)
+
+# #### Dataframe wrappers
+
+def play_offsets(track, keys=('gameId', 'playId')):
+    '''
+    Sort tracking rows by play and compute the per-play offsets used by the kernels.
+    Rows keep their order within a play (the frame order of the tracking data).
+
+    Returns:
+    --------
+    track - sorted tracking dataframe
+    plays - MultiIndex of the plays in sorted order
+    offsets - int64 array of length n_plays + 1
+    '''
+    keys = list(keys)
+    track = track.sort_values(keys, kind='stable')
+
+    key_values = track[keys].to_numpy()
+    new_play = np.ones(len(track), dtype=bool)
+    new_play[1:] = (key_values[1:] != key_values[:-1]).any(axis=1)
+
+    starts = np.flatnonzero(new_play)
+    offsets = np.append(starts, len(track)).astype(np.int64)
+    plays = pd.MultiIndex.from_frame(track.iloc[starts][keys])
+
+    return track, plays, offsets
+
+def endzone_y_batch(pt_play, track_fp, backend=None):
+    '''
+    Batch equivalent of endzone_y_pos.
+
+    Returns:
+    --------
+    pt_play - play dataframe for desired play type with endzone y-position column
+    '''
+    track, plays, offsets = play_offsets(track_fp)
+    mean_y = pd.Series(endzone_y_kernel(track['x'], track['y'], offsets, backend), index=plays)
+
+    pt_play['endzone_y'] = mean_y.reindex(pd.MultiIndex.from_frame(pt_play[['gameId', 'playId']])).to_numpy()
+
+    return pt_play
+
+def kick_attempt_idx_diff(pt_play, track_fp, event, backend=None):
+    '''
+    Batch equivalent of get_kick_attempt_idx_diff for every play in pt_play.
+
+    Returns:
+    --------
+    index_diff - series of index differences aligned to pt_play
+    '''
+    track, plays, offsets = play_offsets(track_fp)
+    idx_diff = pd.Series(idx_diff_kernel(track['event'] == event, track['s'], offsets, backend), index=plays)
+
+    return pd.Series(idx_diff.reindex(pd.MultiIndex.from_frame(pt_play[['gameId', 'playId']])).to_numpy(),
+                     index=pt_play.index)
+
+def kicker_core_dist_batch(pt_play, tracking, track_fp, event, k=5, backend=None):
+    '''
+    Batch equivalent of kicker_core_dist: distance from the kicker to the k-th nearest
+    opposing player at the kick frame of every play.
+
+    Parameters:
+    -----------
+    pt_play - play dataframe for desired play type
+    tracking - tracking data (players) for the play type, e.g. the concatenated output of preprocess_tracking
+    track_fp - football tracking dataframe for desired play type
+    event - string of the event that we want to find, i.e., 'extra_point_attempt'
+    k - Number of nearest neighbors to check (returns distance of k-th nearest player)
+    backend - 'numba', 'numpy' or None to use numba when it is installed
+
+    Returns:
+    --------
+    pt_play - play dataframe for desired play type with new column 'kicker_core_dist_{k}'
+    '''
+    kick_frames = kick_frame_ids(track_fp, event)
+
+    kick = tracking[['gameId', 'playId', 'frameId', 'team', 'position', 'x', 'y']]
+    kick = kick.join(kick_frames, on=['gameId', 'playId'], how='inner')
+    kick = kick[kick['frameId'] == kick['kick_frame']]
+
+    # Kicker ('K', else 'P') position and team per play
+    kickers = kick[kick['position'].isin(['K', 'P'])].copy()
+    kickers['rank'] = (kickers['position'] == 'P').astype(int)
+    kickers = kickers.sort_values('rank', kind='stable').drop_duplicates(['gameId', 'playId'])
+    kickers = kickers.set_index(['gameId', 'playId'])[['team', 'x', 'y']].add_prefix('kicker_')
+
+    kick = kick.join(kickers, on=['gameId', 'playId'], how='inner')
+    kick_team = kick['kicker_team'].to_numpy(dtype=object)
+    opposing = np.where(kick_team == 'home', 'away', 'home')
+    opponents = kick[kick['team'].to_numpy(dtype=object) == opposing]
+
+    dist = np.hypot(opponents['x'].to_numpy(dtype=np.float64) - opponents['kicker_x'].to_numpy(dtype=np.float64),
+                    opponents['y'].to_numpy(dtype=np.float64) - opponents['kicker_y'].to_numpy(dtype=np.float64))
+
+    opponents = opponents[['gameId', 'playId']].assign(dist=dist)
+    opponents, plays, offsets = play_offsets(opponents)
+    core = pd.Series(kth_smallest_kernel(opponents['dist'], offsets, k, backend), index=plays)
+
+    pt_play[f'kicker_core_dist_{k}'] = core.reindex(pd.MultiIndex.from_frame(pt_play[['gameId', 'playId']])).to_numpy()
+
+    return pt_play
@@ -2,7 +2,8 @@ import pandas as pd
 import numpy as np
 from sklearn.preprocessing import StandardScaler, LabelEncoder
 
-from querying.tracking_query import get_play
+from querying.tracking_query import get_play, orient_play_direction
+from pipeline.schema import apply_schema, concat_frames
 
 def ft_in(x):
     if '-' in x:
@@ -15,7 +16,8 @@ def ft_in(x):
 
 def clock(x,df):
     gameClock = df.loc[x]['gameClock']
-    quarter = df.loc[x]['quarter']
+    #python int so the arithmetic below cannot overflow a compact integer dtype
+    quarter = int(df.loc[x]['quarter'])
 
     gameClock_split = gameClock.split(':')
 
@@ -51,34 +53,45 @@ def preprocess_tracking(track18, track19, track20, play_df, play_type):
     track_p19 - Tracking Play Type 2019 dataframe
     track_p20 - Tracking Play Type 2020 dataframe
     '''
-    track18 = track18.copy()
-    track19 = track19.copy()
-    track20 = track20.copy()
-    #re-orient direction of play by offensive team direction : 
-    #We must reorient this to reflect movement in the offense direction instead of the on-field coordinates 
-    #(reorient the origin from the bottom left to top right for a change in direction).
-    #2018 tracking data
-    track18.loc[track18['playDirection'] == 'left', 'x'] = 120 -track18.loc[track18['playDirection']=='left','x']
-    track18.loc[track18['playDirection'] == 'left', 'y'] = 160/3 -track18.loc[track18['playDirection']=='left','y']
-    #note that we have 160/3 for the y direction since the football field is 160ft, but our units are yards
-
-    #2019 tracking data
-    track19.loc[track19['playDirection'] == 'left', 'x'] = 120 -track19.loc[track19['playDirection']=='left','x']
-    track19.loc[track19['playDirection'] == 'left', 'y'] = 160/3 -track19.loc[track19['playDirection']=='left','y']
-
-    #2020 tracking data
-    track20.loc[track20['playDirection'] == 'left', 'x'] = 120 -track20.loc[track20['playDirection']=='left','x']
-    track20.loc[track20['playDirection'] == 'left', 'y'] = 160/3 -track20.loc[track20['playDirection']=='left','y']
+    track_p18 = preprocess_tracking_season(track18, play_df, play_type)
+    track_p19 = preprocess_tracking_season(track19, play_df, play_type)
+    track_p20 = preprocess_tracking_season(track20, play_df, play_type)
+    
+    return track_p18, track_p19, track_p20
+
+def preprocess_tracking_season(track, play_df, play_type):
+    '''
+    This function creates the tracking dataframe by play-type for a single season.
+
+    Parameters:
+    -----------
+    track - trackYY.csv dataframe
+    play_df - play.csv dataframe
+    play_type - string, play type, e.g., 'Extra Point'
 
+    Returns:
+    -----------
+    track_p - Tracking Play Type dataframe for the season
+    '''
     #divide play dataset by type of play
     play_p = play_df.loc[play_df['specialTeamsPlayType']== play_type][['gameId', 'playId']]
     
-    #merge play_type with tracking for each year
-    track_p18 = pd.merge(play_p, track18, left_on = ['gameId', 'playId'], right_on = ['gameId', 'playId'])
-    track_p19 = pd.merge(play_p, track19, left_on = ['gameId', 'playId'], right_on = ['gameId', 'playId'])
-    track_p20 = pd.merge(play_p, track20, left_on = ['gameId', 'playId'], right_on = ['gameId', 'playId'])
-    
-    return track_p18, track_p19, track_p20
+    #merge play_type with tracking
+    #merging first means only the (much smaller) play-type rows are copied and re-oriented,
+    #the merge also returns a new frame so the full tracking input is left untouched
+    track_p = pd.merge(play_p, track, left_on = ['gameId', 'playId'], right_on = ['gameId', 'playId'])
+
+    #keep the compact dtypes (merge keys take the play dataframe's dtype)
+    track_p = apply_schema(track_p)
+
+    #re-orient direction of play by offensive team direction
+    orient_play_direction(track_p)
+
+    return track_p
+
+def football_track(track_p):
+    # Football rows of a tracking by play dataframe, dropping columns that are null for the ball
+    return track_p.loc[track_p['displayName'] == 'football'].dropna(axis = 'columns')
 
 def preprocess_football_track(track_p18, track_p19, track_p20):
     '''
@@ -96,10 +109,10 @@ def preprocess_football_track(track_p18, track_p19, track_p20):
     
     #separate out the football data in each year's tracking dataframe and drop null values
     #concatenate to one dataframe for football tracking data
-    track_fp18 = track_p18.loc[track_p18['displayName'] == 'football'].dropna(axis = 'columns')
-    track_fp19 = track_p19.loc[track_p19['displayName'] == 'football'].dropna(axis = 'columns')
-    track_fp20 = track_p20.loc[track_p20['displayName'] == 'football'].dropna(axis = 'columns')
-    track_fp = pd.concat([track_fp18, track_fp19, track_fp20], ignore_index = True)
+    track_fp18 = football_track(track_p18)
+    track_fp19 = football_track(track_p19)
+    track_fp20 = football_track(track_p20)
+    track_fp = concat_frames([track_fp18, track_fp19, track_fp20], ignore_index = True)
     
     return track_fp
 
@@ -156,35 +169,15 @@ def preprocess_ep(ep_plays, encode_categorical = True):
     columns = ep_plays.columns
     
     useful_cols.extend(col for col in columns if 'kicker_core_dist' in col)
+    #trajectory fit features, when computed with kick_trajectory
+    useful_cols.extend(col for col in ['kick_curvature', 'kick_fit_residual'] if col in columns)
                 
     #need to drop nulls for clustering
     ep_df = ep_plays[useful_cols].dropna()
     
-    new_eps = ep_df.drop(['specialTeamsResult', 'penaltyCodes'], axis=1)
-    #new_eps['specialTeamsResult'] = ohe_str
-    #new_eps['penaltyCodes'] = ohe_pc
-    
-    #scale data, but only non-categorical columns
-    scale = StandardScaler()
-    ep_scale = scale.fit_transform(new_eps)
-    #TO-DO QUESTION: do we want to scale categoricals too? No
-    
-    #make this back into a data frame
-    ep_scale = pd.DataFrame(ep_scale, columns = new_eps.columns)
-    
-    #add categorical columns back
-    if encode_categorical:
-        #one-hot-encode SpecialTeamsResult and penaltyCodes
-        le_str = LabelEncoder()
-        le_pc = LabelEncoder()
-        ohe_str = le_str.fit_transform(ep_df['specialTeamsResult'])
-        ohe_pc = le_pc.fit_transform(ep_df['penaltyCodes'])
-        
-        ep_scale['specialTeamsResult'] = ohe_str
-        ep_scale['penaltyCodes'] = ohe_pc
-    else:
-        ep_scale['specialTeamsResult'] = ep_df['specialTeamsResult']
-        ep_scale['penaltyCodes'] =ep_df['penaltyCodes']
+    #scale the non-categorical columns and label-encode the categoricals (or keep them as is)
+    scale, encoders = fit_scaling(ep_df, encode_categorical)
+    ep_scale = apply_scaling(ep_df, scale, encoders)
         
     return ep_scale, ep_df
 
@@ -217,37 +210,68 @@ def preprocess_fg(fg_plays, encode_categorical=True):
     columns = fg_plays.columns
     
     useful_cols.extend(col for col in columns if 'kicker_core_dist' in col)
+    #trajectory fit features, when computed with kick_trajectory
+    useful_cols.extend(col for col in ['kick_curvature', 'kick_fit_residual'] if col in columns)
     
     #need to drop nulls for clustering
     fg_df = fg_plays[useful_cols].dropna()
     
-    new_fgs = fg_df.drop(['specialTeamsResult', 'penaltyCodes'], axis=1)
-    #new_fgs['specialTeamsResult'] = ohe_str
-    #new_fgs['penaltyCodes'] = ohe_pc
-    
-    #scale data, but only non-categorical columns
-    scale = StandardScaler()
-    fg_scale = scale.fit_transform(new_fgs)
-    
-    #make this back into a data frame
-    fg_scale = pd.DataFrame(fg_scale, columns = new_fgs.columns)
-    
-    #add categorical columns back
-    if encode_categorical:
-        #one-hot-encode SpecialTeamsResult and penaltyCodes
-        le_str = LabelEncoder()
-        le_pc = LabelEncoder()
-        ohe_str = le_str.fit_transform(fg_df['specialTeamsResult'])
-        ohe_pc = le_pc.fit_transform(fg_df['penaltyCodes'])
-        
-        fg_scale['specialTeamsResult'] = ohe_str
-        fg_scale['penaltyCodes'] = ohe_pc
-    else:
-        fg_scale['specialTeamsResult'] = fg_df['specialTeamsResult']
-        fg_scale['penaltyCodes'] = fg_df['penaltyCodes']
+    #scale the non-categorical columns and label-encode the categoricals (or keep them as is)
+    scale, encoders = fit_scaling(fg_df, encode_categorical)
+    fg_scale = apply_scaling(fg_df, scale, encoders)
     
     return fg_scale, fg_df
 
+# Categorical columns of the preprocess_ep/preprocess_fg tables, label-encoded instead of scaled
+CATEGORICAL_COLS = ['specialTeamsResult', 'penaltyCodes']
+
+def fit_scaling(pt_df, encode_categorical=True):
+    '''
+    Fit the clustering transform used by preprocess_ep/preprocess_fg (StandardScaler on the
+    numeric columns, LabelEncoder per categorical column) so it can be stored and reapplied
+    to new plays.
+
+    Parameters:
+    -----------
+    pt_df - truncated play dataframe without the scaling (second output of preprocess_ep/preprocess_fg)
+    encode_categorical - Boolean, fit the LabelEncoders, default is True
+
+    Returns:
+    -----------
+    scale - StandardScaler fit on the numeric columns
+    encoders - dict of categorical column to fitted LabelEncoder, None if encode_categorical is False
+    '''
+    scale = StandardScaler().fit(pt_df.drop(CATEGORICAL_COLS, axis=1))
+    encoders = {col: LabelEncoder().fit(pt_df[col]) for col in CATEGORICAL_COLS} if encode_categorical else None
+
+    return scale, encoders
+
+def apply_scaling(pt_df, scale, encoders):
+    '''
+    Apply a transform from fit_scaling. Category values not seen at fit time are encoded as -1,
+    without encoders the categorical columns are kept as they are.
+
+    Parameters:
+    -----------
+    pt_df - truncated play dataframe without the scaling
+    scale, encoders - output of fit_scaling
+
+    Returns:
+    -----------
+    pt_scale - scaled/processed play dataframe
+    '''
+    numeric = pt_df[list(scale.feature_names_in_)]
+    pt_scale = pd.DataFrame(scale.transform(numeric), columns = numeric.columns)
+
+    for col in CATEGORICAL_COLS:
+        if encoders is None:
+            pt_scale[col] = pt_df[col].to_numpy()
+            continue
+        codes = {label: code for code, label in enumerate(encoders[col].classes_)}
+        pt_scale[col] = [codes.get(label, -1) for label in pt_df[col]]
+
+    return pt_scale
+
 def get_kick_attempt_idx_diff(game_id, play_id, track_fp, event):
     '''
     For a given gameId and playId, return the difference in index between the event as labelled and the maximum speed of the ball.
@@ -312,4 +336,151 @@ def drop_by_index_difference(pt_play, track_fp, event, threshold=7):
     # Filter using the above series as a boolean mask
     filtered_pt_play = pt_play[index_diff <= threshold]
 
-    return filtered_pt_play
\ No newline at end of file
+    return filtered_pt_play
+
+FLAG_COLS = ['impossible_speed', 'impossible_velocity', 'impossible_acceleration', 'teleport', 'frozen', 'speed_mismatch']
+
+def _next_in_play(values, next_same_play):
+    # values shifted one frame ahead, NaN where the next frame belongs to another play
+    shifted = np.append(values[1:], np.nan)
+    shifted[~next_same_play] = np.nan
+    return shifted
+
+def ball_tracking_anomalies(track_fp, max_speed=40, teleport_dist=5, frozen_speed=1, speed_tol=5, max_accel=50):
+    '''
+    Flag physically implausible football tracking for every play at once.
+
+    Velocity is computed from the positional difference to the previous frame (0.1s apart) of
+    the same play and acceleration from the central second difference of position around the
+    frame, and each frame is checked for:
+        - impossible_speed: reported speed 's' above max_speed
+        - impossible_velocity: displacement speed above max_speed
+        - impossible_acceleration: acceleration above max_accel at the frame and above max_accel/2
+          at both neighbouring frames
+        - teleport: the ball moves more than teleport_dist yards in a single frame
+        - frozen: position does not change on either side of the frame while 's' says the ball is moving
+        - speed_mismatch: 's' differs from the displacement speed on both sides of the frame by more than speed_tol
+
+    The checks look at both sides of the frame so the kick itself (ball at rest before, in flight
+    after) and the landing are not flagged while a single misplaced frame is: a frame moved d
+    yards out of line has an acceleration of 2d/dt^2 with d/dt^2 at both neighbours, the kick is
+    a single isolated peak.
+
+    Parameters:
+    -----------
+    track_fp - football-specific tracking dataframe for play type
+    max_speed - maximum plausible ball speed in yards/s (a kick leaves the foot at ~30 yards/s)
+    teleport_dist - maximum plausible single-frame displacement in yards
+    frozen_speed - reported speed in yards/s above which an unchanged position counts as frozen
+    speed_tol - allowed difference in yards/s between 's' and the displacement speed
+    max_accel - maximum plausible acceleration in yards/s^2 outside the kick
+
+    Returns:
+    --------
+    quality - dataframe indexed by (gameId, playId) with the number of frames, the count of
+              each flag, the largest displacement speed and acceleration magnitude (so sharp
+              decelerations count too; 'max_velocity', 'max_acceleration') and 'quality_score'
+              (fraction of frames with no flag)
+    mask - boolean series aligned to track_fp, True for frames with no flag
+    '''
+    ball = track_fp[['gameId', 'playId', 'frameId', 'x', 'y', 's']].sort_values(['gameId', 'playId', 'frameId'])
+
+    keys = ball[['gameId', 'playId']].to_numpy()
+    frame = ball['frameId'].to_numpy(dtype=np.float64)
+    x = ball['x'].to_numpy(dtype=np.float64)
+    y = ball['y'].to_numpy(dtype=np.float64)
+    s = ball['s'].to_numpy(dtype=np.float64)
+
+    # Backward differences within a play (NaN at the first frame of every play)
+    same_play = np.zeros(len(ball), dtype=bool)
+    same_play[1:] = (keys[1:] == keys[:-1]).all(axis=1)
+
+    step = np.full(len(ball), np.nan)
+    dt = np.full(len(ball), np.nan)
+    step[1:] = np.hypot(np.diff(x), np.diff(y))
+    dt[1:] = np.diff(frame) / 10
+    step[~same_play] = np.nan
+    dt[~same_play] = np.nan
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        velocity = step / dt
+
+    # Same quantities one frame ahead (NaN at the last frame of every play)
+    next_same_play = np.append(same_play[1:], False)
+
+    next_step = _next_in_play(step, next_same_play)
+    next_velocity = _next_in_play(velocity, next_same_play)
+
+    # Central second difference of position, (p[i+1] - 2p[i] + p[i-1]) / dt^2 for evenly spaced
+    # frames, NaN at the first and last frame of every play
+    dx = np.full(len(ball), np.nan)
+    dy = np.full(len(ball), np.nan)
+    dx[1:] = np.diff(x)
+    dy[1:] = np.diff(y)
+    dx[~same_play] = np.nan
+    dy[~same_play] = np.nan
+    next_dt = _next_in_play(dt, next_same_play)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ax = 2 * (_next_in_play(dx, next_same_play) / next_dt - dx / dt) / (dt + next_dt)
+        ay = 2 * (_next_in_play(dy, next_same_play) / next_dt - dy / dt) / (dt + next_dt)
+    acceleration = np.hypot(ax, ay)
+
+    prev_acceleration = np.append(np.nan, acceleration[:-1])
+    prev_acceleration[~same_play] = np.nan
+
+    # Checks on both sides of the frame (fmin/fmax ignore the missing side at play boundaries)
+    moved = np.fmax(step, next_step)
+    mismatch = np.fmin(np.abs(s - velocity), np.abs(s - next_velocity))
+    neighbour_accel = np.fmin(prev_acceleration, _next_in_play(acceleration, next_same_play))
+
+    flags = pd.DataFrame({
+        'impossible_speed': s > max_speed,
+        'impossible_velocity': velocity > max_speed,
+        'impossible_acceleration': (acceleration > max_accel) & (neighbour_accel > max_accel / 2),
+        'teleport': step > teleport_dist,
+        'frozen': (moved == 0) & (s > frozen_speed),
+        'speed_mismatch': mismatch > speed_tol,
+    }, index=ball.index)
+
+    mask = ~flags.any(axis=1)
+
+    flags['gameId'] = ball['gameId'].to_numpy()
+    flags['playId'] = ball['playId'].to_numpy()
+    flags['velocity'] = velocity
+    flags['acceleration'] = acceleration
+    flags['clean'] = mask
+
+    grouped = flags.groupby(['gameId', 'playId'])
+    quality = grouped[FLAG_COLS].sum()
+    quality.insert(0, 'n_frames', grouped.size())
+    quality['max_velocity'] = grouped['velocity'].max()
+    quality['max_acceleration'] = grouped['acceleration'].max()
+    quality['quality_score'] = grouped['clean'].mean()
+
+    return quality, mask.reindex(track_fp.index)
+
+def drop_by_tracking_quality(pt_play, track_fp, min_quality=0.95):
+    '''
+    Drop plays whose football tracking fails the physics checks in ball_tracking_anomalies,
+    in one pass over the ball data.
+
+    Parameters:
+    -----------
+    pt_play - DataFrame containing data for a specific play type (e.g. field goals, extra points)
+    track_fp - football-specific tracking dataframe for play type
+    min_quality - minimum fraction of clean frames required to keep a play
+
+    Returns:
+    --------
+    filtered_pt_play - pt_play with low-quality (or untracked) plays dropped
+    '''
+    quality, _ = ball_tracking_anomalies(track_fp)
+    scores = quality['quality_score']
+
+    play_score = pt_play.join(scores, on=['gameId', 'playId'])['quality_score']
+
+    # Filter using the above series as a boolean mask
+    filtered_pt_play = pt_play[play_score >= min_quality]
+
+    return filtered_pt_play
@@ -0,0 +1,349 @@
+'''
+Command-line driver for the extra point / field goal pipeline.
+
+The pipeline is declared as a graph of stages. Stages whose inputs are ready run
+concurrently on a process pool (the seasons and the extra point / field goal branches are
+independent), every stage output is checkpointed to disk, and a rerun resumes from the
+last completed stages whose settings and input files are unchanged. A critical-path timing
+summary is printed at the end.
+
+Usage:
+    python -m pipeline.run --data-dir ~/Documents/NFL/Data --out-dir output
+'''
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import pickle
+import time
+
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from pipeline.schema import load_plays, load_players, load_tracking, concat_frames
+from pipeline.preprocessing import (preprocess_play, preprocess_players, preprocess_tracking_season,
+                                    football_track, preprocess_ep, preprocess_fg)
+from pipeline.dataset_builders import make_extra_point, make_field_goal
+from pipeline.feature_engineering import kick_trajectory, endzone_y_error, endzone_y_off_center
+from pipeline.kernels import endzone_y_batch, kick_attempt_idx_diff, kicker_core_dist_batch
+from pipeline.clustering import cluster_df
+
+Stage = namedtuple('Stage', ['name', 'func', 'deps', 'kwargs'])
+
+# Short name of each play type branch: (specialTeamsPlayType, kick event, table builder, clustering preprocessor)
+PLAY_TYPES = {
+    'ep': ('Extra Point', 'extra_point_attempt', make_extra_point, preprocess_ep),
+    'fg': ('Field Goal', 'field_goal_attempt', make_field_goal, preprocess_fg),
+}
+
+# #### Stage functions (module level so they can run in worker processes)
+
+def _plays(path):
+    return preprocess_play(load_plays(path))
+
+def _players(path):
+    return preprocess_players(load_players(path))
+
+def _football(*tracks):
+    return concat_frames([football_track(track_p) for track_p in tracks], ignore_index=True)
+
+def _drop_by_index_difference(play_df, track_fp, event, threshold=7):
+    # Same filter as drop_by_index_difference, using the batch kernel
+    return play_df[kick_attempt_idx_diff(play_df, track_fp, event) <= threshold]
+
+def _table(play_df, players_df, track_fp, builder):
+    return builder(play_df, players_df, track_fp)
+
+def _features(pt_play, track_fp, *tracks, event, core_dists=(1, 3)):
+    pt_play = endzone_y_batch(pt_play, track_fp)
+    pt_play = endzone_y_off_center(pt_play)
+    pt_play = kick_trajectory(pt_play, track_fp, event)
+    pt_play = endzone_y_error(pt_play)
+
+    tracking = concat_frames(tracks)
+    for k in core_dists:
+        pt_play = kicker_core_dist_batch(pt_play, tracking, track_fp, event, k=k)
+
+    return pt_play
+
+def _clusters(pt_play, preprocess):
+    pt_scale, pt_df = preprocess(pt_play)
+    _, pt_df = cluster_df(pt_scale, pt_df)
+    return pt_df
+
+def build_stages(data_dir, seasons=(2018, 2019, 2020), play_types=('ep', 'fg')):
+    '''
+    Declare the stage graph of the pipeline.
+
+    Parameters:
+    -----------
+    data_dir - directory with plays.csv, players.csv and trackingYYYY.csv
+    seasons - seasons to include
+    play_types - branches to run, keys of PLAY_TYPES
+
+    Returns:
+    --------
+    stages - list of Stage(name, func, deps, kwargs) in a valid topological order
+    '''
+    stages = [
+        Stage('plays', _plays, [], {'path': os.path.join(data_dir, 'plays.csv')}),
+        Stage('players', _players, [], {'path': os.path.join(data_dir, 'players.csv')}),
+    ]
+
+    for season in seasons:
+        stages.append(Stage(f'tracking_{season}', load_tracking, [],
+                            {'path': os.path.join(data_dir, f'tracking{season}.csv')}))
+
+    for pt in play_types:
+        play_type, event, builder, preprocess = PLAY_TYPES[pt]
+        track_stages = [f'track_{pt}_{season}' for season in seasons]
+
+        for season, name in zip(seasons, track_stages):
+            stages.append(Stage(name, preprocess_tracking_season, [f'tracking_{season}', 'plays'],
+                                {'play_type': play_type}))
+
+        stages.extend([
+            Stage(f'ball_{pt}', _football, track_stages, {}),
+            Stage(f'plays_{pt}', _drop_by_index_difference, ['plays', f'ball_{pt}'], {'event': event}),
+            Stage(f'table_{pt}', _table, [f'plays_{pt}', 'players', f'ball_{pt}'], {'builder': builder}),
+            Stage(f'features_{pt}', _features, [f'table_{pt}', f'ball_{pt}'] + track_stages, {'event': event}),
+            Stage(f'clusters_{pt}', _clusters, [f'features_{pt}'], {'preprocess': preprocess}),
+        ])
+
+    return stages
+
+# #### Checkpoints
+
+def _describe(value):
+    # Stable description of a stage setting: functions by name, data files by path, size and mtime
+    if callable(value):
+        return f'{value.__module__}.{value.__qualname__}'
+    if isinstance(value, str) and os.path.isfile(value):
+        stat = os.stat(value)
+        return [os.path.abspath(value), stat.st_size, stat.st_mtime_ns]
+    return repr(value)
+
+def stage_keys(stages):
+    '''
+    Hash of every stage's function, kwargs (including the data files it reads) and the keys
+    of its dependencies, so a checkpoint is only reused for the same inputs and settings.
+
+    Returns:
+    --------
+    keys - dict of stage name to hex digest
+    '''
+    keys = {}
+
+    for stage in stages:
+        description = {
+            'func': _describe(stage.func),
+            'kwargs': {name: _describe(value) for name, value in stage.kwargs.items()},
+            'deps': [keys.get(dep) for dep in stage.deps],
+        }
+        keys[stage.name] = hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+    return keys
+
+def _checkpoint_path(checkpoint_dir, name):
+    return os.path.join(checkpoint_dir, f'{name}.pkl')
+
+def _key_path(checkpoint_dir, name):
+    return os.path.join(checkpoint_dir, f'{name}.key')
+
+def _checkpoint_key(checkpoint_dir, name):
+    # Key the checkpoint was written with, None if there is no (complete) checkpoint
+    if not os.path.exists(_checkpoint_path(checkpoint_dir, name)):
+        return None
+    try:
+        with open(_key_path(checkpoint_dir, name)) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+def _load_checkpoint(checkpoint_dir, name):
+    with open(_checkpoint_path(checkpoint_dir, name), 'rb') as f:
+        return pickle.load(f)
+
+def _save_checkpoint(checkpoint_dir, name, output, key):
+    # Write then rename, so a crash never leaves a partial checkpoint behind. The key is
+    # removed first and written last, so a checkpoint only matches once it is complete
+    path = _checkpoint_path(checkpoint_dir, name)
+    key_path = _key_path(checkpoint_dir, name)
+    if os.path.exists(key_path):
+        os.remove(key_path)
+
+    with open(path + '.tmp', 'wb') as f:
+        pickle.dump(output, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + '.tmp', path)
+
+    with open(key_path + '.tmp', 'w') as f:
+        f.write(key)
+    os.replace(key_path + '.tmp', key_path)
+
+def _run_stage(stage, checkpoint_dir, key):
+    # Worker entry point: inputs and output go through the checkpoints
+    inputs = [_load_checkpoint(checkpoint_dir, dep) for dep in stage.deps]
+
+    start = time.perf_counter()
+    output = stage.func(*inputs, **stage.kwargs)
+    duration = time.perf_counter() - start
+
+    _save_checkpoint(checkpoint_dir, stage.name, output, key)
+
+    return duration
+
+# #### Scheduler
+
+def run_stages(stages, checkpoint_dir, workers=None, force=()):
+    '''
+    Run a stage graph on a process pool, starting every stage as soon as its dependencies
+    are done. Stages with a checkpoint written for the same key (see stage_keys) are skipped
+    (resume after a crash); a stage whose settings, data files or upstream stages changed
+    since its checkpoint was written is rerun.
+
+    Parameters:
+    -----------
+    stages - list of Stage
+    checkpoint_dir - directory for stage outputs and timings
+    workers - number of worker processes, default is the cpu count
+    force - names of stages to rerun even if checkpointed (their dependents rerun too)
+
+    Returns:
+    --------
+    timings - dict of stage name to run time in seconds (from a previous run if resumed)
+    '''
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    by_name = {stage.name: stage for stage in stages}
+
+    timings_path = os.path.join(checkpoint_dir, 'timings.json')
+    timings = {}
+    if os.path.exists(timings_path):
+        with open(timings_path) as f:
+            timings = json.load(f)
+
+    # A stage is done if its checkpoint matches its key and nothing upstream of it is being rerun
+    keys = stage_keys(stages)
+    done = set()
+    for stage in stages:
+        checkpointed = _checkpoint_key(checkpoint_dir, stage.name) == keys[stage.name]
+        if checkpointed and stage.name not in force and all(dep in done for dep in stage.deps):
+            done.add(stage.name)
+
+    pending = [stage for stage in stages if stage.name not in done]
+    for stage in stages:
+        if stage.name in done:
+            print(f'[resume] {stage.name}')
+
+    running = {}
+    failed = None
+
+    # Workers are spawned rather than forked, forking a process that already runs threads
+    # (e.g. the numba/BLAS thread pools after calling the kernels) can deadlock the workers
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        while pending or running:
+            if failed is None:
+                ready = [stage for stage in pending if all(dep in done for dep in stage.deps)]
+                for stage in ready:
+                    pending.remove(stage)
+                    running[pool.submit(_run_stage, stage, checkpoint_dir, keys[stage.name])] = stage.name
+                    print(f'[start]  {stage.name}')
+
+            if not running:
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    timings[name] = future.result()
+                except Exception as e:
+                    print(f'[failed] {name}: {e!r}')
+                    failed = failed or e
+                    continue
+
+                done.add(name)
+                print(f'[done]   {name} ({timings[name]:.1f}s)')
+
+                with open(timings_path, 'w') as f:
+                    json.dump(timings, f, indent=2)
+
+    if failed is not None:
+        raise failed
+
+    missing = [stage.name for stage in stages if stage.name not in done]
+    if missing:
+        raise RuntimeError(f'Stages not run (unknown dependencies?): {missing}')
+
+    return {name: timings.get(name, 0.0) for name in by_name}
+
+def critical_path(stages, timings):
+    '''
+    Longest chain of dependent stages by run time, i.e. the lower bound on wall time
+    however many workers are used.
+
+    Returns:
+    --------
+    path - list of stage names along the critical path
+    length - total run time of the path in seconds
+    '''
+    finish = {}
+    previous = {}
+
+    for stage in stages:
+        start = 0.0
+        previous[stage.name] = None
+        for dep in stage.deps:
+            if finish[dep] > start:
+                start = finish[dep]
+                previous[stage.name] = dep
+        finish[stage.name] = start + timings.get(stage.name, 0.0)
+
+    name = max(finish, key=finish.get)
+    length = finish[name]
+
+    path = []
+    while name is not None:
+        path.append(name)
+        name = previous[name]
+
+    return path[::-1], length
+
+def print_summary(stages, timings, wall_time):
+    # Stage timings and critical path
+    path, length = critical_path(stages, timings)
+    total = sum(timings.values())
+
+    print('\nStage timings:')
+    for stage in stages:
+        marker = '*' if stage.name in path else ' '
+        print(f' {marker} {stage.name:<20} {timings.get(stage.name, 0.0):8.1f}s')
+
+    print(f'\nCritical path ({length:.1f}s): ' + ' -> '.join(path))
+    print(f'Sum of stage times: {total:.1f}s, wall time: {wall_time:.1f}s')
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the extra point / field goal pipeline.')
+    parser.add_argument('--data-dir', required=True, help='directory with plays.csv, players.csv and trackingYYYY.csv')
+    parser.add_argument('--out-dir', default='output', help='directory for checkpoints and cluster tables')
+    parser.add_argument('--seasons', type=int, nargs='+', default=[2018, 2019, 2020])
+    parser.add_argument('--play-types', nargs='+', choices=sorted(PLAY_TYPES), default=['ep', 'fg'])
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes')
+    parser.add_argument('--force', nargs='*', default=[], help='stages to rerun even if checkpointed')
+    args = parser.parse_args(argv)
+
+    stages = build_stages(os.path.expanduser(args.data_dir), args.seasons, args.play_types)
+    checkpoint_dir = os.path.join(args.out_dir, 'checkpoints')
+
+    start = time.perf_counter()
+    timings = run_stages(stages, checkpoint_dir, workers=args.workers, force=set(args.force))
+    wall_time = time.perf_counter() - start
+
+    for pt in args.play_types:
+        clusters = _load_checkpoint(checkpoint_dir, f'clusters_{pt}')
+        clusters.to_csv(os.path.join(args.out_dir, f'{pt}_clusters.csv'))
+
+    print_summary(stages, timings, wall_time)
+
+if __name__ == '__main__':
+    main()
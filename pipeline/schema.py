@@ -0,0 +1,249 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from pandas.api.types import union_categoricals
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, RSS is then left out of the memory report
+    resource = None
+
+# Compact dtypes for the Big Data Bowl tables. Coordinates and kinematics fit comfortably
+# in float32, ids fit in 32/16-bit ints and the repeated strings are stored as categoricals.
+# Columns that may be null (nflId/jerseyNumber for the football, kickerId, ...) stay floating point.
+# Integers that feed arithmetic (quarter in clock, scores, frame offsets) are at least int16,
+# numpy 2 keeps the narrow dtype in scalar arithmetic and int8 overflows.
+TRACKING_DTYPES = {
+    'gameId': np.int32,
+    'playId': np.int16,
+    'frameId': np.int16,
+    'nflId': np.float32,
+    'jerseyNumber': np.float32,
+    'x': np.float32,
+    'y': np.float32,
+    's': np.float32,
+    'a': np.float32,
+    'dis': np.float32,
+    'o': np.float32,
+    'dir': np.float32,
+    'team': 'category',
+    'event': 'category',
+    'displayName': 'category',
+    'position': 'category',
+    'playDirection': 'category',
+}
+
+# The tracking files mark missing values with 'NA' and use the string 'None' as the event of
+# frames without one, which newer pandas would otherwise also read as null
+TRACKING_NA_VALUES = ['', 'NA']
+
+PLAY_DTYPES = {
+    'gameId': np.int32,
+    'playId': np.int16,
+    'quarter': np.int16,
+    'possessionTeam': 'category',
+    'specialTeamsPlayType': 'category',
+    'specialTeamsResult': 'category',
+    'kickerId': np.float32,
+    'returnerId': np.float32,
+    'kickBlockerId': np.float32,
+    'yardlineSide': 'category',
+    'yardlineNumber': np.float32,
+    'preSnapHomeScore': np.int16,
+    'preSnapVisitorScore': np.int16,
+    'penaltyYards': np.float32,
+    'kickLength': np.float32,
+    'kickReturnYardage': np.float32,
+    'playResult': np.float32,
+    'absoluteYardlineNumber': np.float32,
+    'passResult': 'category',
+}
+
+PLAYER_DTYPES = {
+    'nflId': np.int32,
+    'weight': np.int16,
+    'Position': 'category',
+}
+
+def apply_schema(df, dtypes=TRACKING_DTYPES):
+    '''
+    Cast the columns of df that appear in dtypes to their compact type. Columns not in the
+    schema (or not in df) are left alone.
+
+    Parameters:
+    -----------
+    df - dataframe to cast
+    dtypes - mapping of column name to dtype, default is TRACKING_DTYPES
+
+    Returns:
+    --------
+    df - dataframe with compact dtypes
+    '''
+    cast = {col: dtype for col, dtype in dtypes.items() if col in df.columns and df[col].dtype != dtype}
+
+    return df.astype(cast) if cast else df
+
+def load_tracking(path, columns=None):
+    '''
+    Read a trackingYYYY.csv file directly into the compact schema.
+
+    Parameters:
+    -----------
+    path - path to tracking csv
+    columns - optional list of columns to read, default is all
+
+    Returns:
+    --------
+    track - tracking dataframe with TRACKING_DTYPES applied
+    '''
+    return pd.read_csv(path, usecols=columns, dtype=TRACKING_DTYPES,
+                       keep_default_na=False, na_values=TRACKING_NA_VALUES)
+
+def load_plays(path):
+    '''
+    Read plays.csv into the compact schema.
+
+    Parameters:
+    -----------
+    path - path to plays.csv
+
+    Returns:
+    --------
+    play_df - play dataframe with PLAY_DTYPES applied
+    '''
+    return pd.read_csv(path, dtype=PLAY_DTYPES)
+
+def load_players(path):
+    '''
+    Read players.csv into the compact schema.
+
+    Parameters:
+    -----------
+    path - path to players.csv
+
+    Returns:
+    --------
+    players_df - player dataframe with PLAYER_DTYPES applied
+    '''
+    return pd.read_csv(path, dtype=PLAYER_DTYPES)
+
+def concat_frames(frames, ignore_index=False):
+    '''
+    Concatenate dataframes without losing categoricals. pd.concat upcasts a categorical
+    column to object whenever the frames carry different categories (e.g. different
+    events or player names per season), so categories are unioned before concatenating.
+
+    Parameters:
+    -----------
+    frames - list of dataframes with the same columns
+    ignore_index - passed through to pd.concat
+
+    Returns:
+    --------
+    df - concatenated dataframe
+    '''
+    frames = list(frames)
+
+    if len(frames) > 1:
+        cat_cols = [col for col in frames[0].columns
+                    if all(col in f.columns and isinstance(f[col].dtype, pd.CategoricalDtype) for f in frames)]
+
+        if cat_cols:
+            frames = [f.copy(deep=False) for f in frames]
+            for col in cat_cols:
+                # Frames where the column is all null carry empty categories of another dtype
+                filled = [f[col] for f in frames if len(f[col].cat.categories)]
+                if not filled:
+                    continue
+                categories = union_categoricals(filled).categories
+                for f in frames:
+                    f[col] = f[col].cat.set_categories(categories)
+
+    return pd.concat(frames, ignore_index=ignore_index)
+
+def memory_mb(df):
+    # Deep memory usage of a dataframe in MB
+    return df.memory_usage(deep=True).sum() / 2**20
+
+def current_rss_mb():
+    # Current resident set size of this process in MB (None where unavailable)
+    try:
+        with open('/proc/self/statm') as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError, AttributeError):
+        pass
+
+    if resource is None:
+        return None
+
+    # Peak instead of current RSS where /proc is not available (ru_maxrss is in bytes on macOS)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**20
+
+def _frame_summary(df):
+    dtypes = df.dtypes
+    return {
+        'rows': len(df),
+        'columns': df.shape[1],
+        'memory_mb': memory_mb(df),
+        'categorical_cols': int(sum(isinstance(d, pd.CategoricalDtype) for d in dtypes)),
+        'object_cols': int(sum(d == object or isinstance(d, pd.StringDtype) for d in dtypes)),
+    }
+
+def memory_report(**stages):
+    '''
+    Summarize the memory footprint of the dataframes produced at each pipeline stage,
+    e.g. memory_report(tracking=track18, track_ep=track_ep18, track_fp=track_fp).
+
+    Parameters:
+    -----------
+    **stages - dataframes keyed by stage name
+
+    Returns:
+    --------
+    report - dataframe indexed by stage with 'rows', 'columns', 'memory_mb',
+             'categorical_cols' and 'object_cols'
+    '''
+    rows = [dict(stage=stage, **_frame_summary(df)) for stage, df in stages.items()]
+
+    return pd.DataFrame(rows).set_index('stage')
+
+class MemoryReport:
+    '''
+    Per-stage memory report that also samples the process RSS at each stage boundary.
+    Call record right after a stage produces its output:
+
+        report = MemoryReport()
+        track18 = load_tracking(path)
+        report.record('load_2018', track18)
+        track_ep18 = preprocess_tracking_season(track18, play_df, 'Extra Point')
+        report.record('track_ep_2018', track_ep18)
+        report.to_frame()
+    '''
+
+    def __init__(self):
+        self.rows = []
+        self._last_rss = current_rss_mb()
+
+    def record(self, stage, df):
+        '''
+        Record the footprint of df and the process RSS (and its change since the previous
+        boundary) after stage.
+        '''
+        rss = current_rss_mb()
+        delta = rss - self._last_rss if rss is not None and self._last_rss is not None else None
+        self._last_rss = rss
+
+        self.rows.append(dict(stage=stage, **_frame_summary(df), rss_mb=rss, rss_delta_mb=delta))
+
+    def to_frame(self):
+        '''
+        Returns:
+        --------
+        report - dataframe indexed by stage with the memory_report columns plus 'rss_mb'
+                 and 'rss_delta_mb'
+        '''
+        return pd.DataFrame(self.rows).set_index('stage')
@@ -0,0 +1,263 @@
+import numpy as np
+import pandas as pd
+
+# Team codes used in the frame blocks (-1 marks an empty slot)
+HOME, AWAY, FOOTBALL = 0, 1, 2
+
+class FrameBlocks:
+    '''
+    Tracking data packed into dense per-frame arrays. Each frame holds at most 23
+    entities (22 players and the football), so proximity queries are answered with
+    vectorized distance computations over all frames at once instead of a spatial tree
+    or per-play pandas filtering.
+
+    Attributes:
+    -----------
+    frames - dataframe with one row per frame: 'gameId', 'playId', 'frameId', 'event'
+    xy - (n_frames, n_slots, 2) float32 positions, NaN in empty slots
+    team - (n_frames, n_slots) int8 team codes (HOME, AWAY, FOOTBALL, -1 for empty)
+    nfl_id - (n_frames, n_slots) nflId of each slot, NaN for the football and empty slots
+    kicker_slot - (n_frames,) slot of the kicker ('K', else 'P'), -1 if neither is on the field
+    ball_slot - (n_frames,) slot of the football, -1 if not tracked
+    '''
+
+    def __init__(self, frames, xy, team, nfl_id, kicker_slot, ball_slot):
+        self.frames = frames
+        self.xy = xy
+        self.team = team
+        self.nfl_id = nfl_id
+        self.kicker_slot = kicker_slot
+        self.ball_slot = ball_slot
+
+    def __len__(self):
+        return len(self.frames)
+
+def _first_slot(mask):
+    # Index of the first True along the last axis, -1 where there is none
+    return np.where(mask.any(axis=1), mask.argmax(axis=1), -1)
+
+def build_frame_blocks(tracking):
+    '''
+    Pack a tracking dataframe (players and football, any number of plays) into FrameBlocks.
+
+    Parameters:
+    -----------
+    tracking - tracking dataframe, e.g. output of preprocess_tracking
+
+    Returns:
+    --------
+    blocks - FrameBlocks for every (gameId, playId, frameId) in tracking
+    '''
+    track = tracking.sort_values(['gameId', 'playId', 'frameId'], kind='stable')
+
+    keys = track[['gameId', 'playId', 'frameId']].to_numpy()
+    new_frame = np.ones(len(track), dtype=bool)
+    new_frame[1:] = (keys[1:] != keys[:-1]).any(axis=1)
+
+    starts = np.flatnonzero(new_frame)
+    frame_idx = np.cumsum(new_frame) - 1
+    slot = np.arange(len(track)) - starts[frame_idx]
+
+    n_frames = len(starts)
+    n_slots = int(slot.max()) + 1 if len(track) else 0
+
+    xy = np.full((n_frames, n_slots, 2), np.nan, dtype=np.float32)
+    xy[frame_idx, slot, 0] = track['x'].to_numpy(dtype=np.float32)
+    xy[frame_idx, slot, 1] = track['y'].to_numpy(dtype=np.float32)
+
+    team_values = track['team'].to_numpy(dtype=object)
+    team = np.full((n_frames, n_slots), -1, dtype=np.int8)
+    team[frame_idx, slot] = np.select([team_values == 'home', team_values == 'away', team_values == 'football'],
+                                      [HOME, AWAY, FOOTBALL], default=-1)
+
+    nfl_id = np.full((n_frames, n_slots), np.nan)
+    nfl_id[frame_idx, slot] = track['nflId'].to_numpy(dtype=np.float64)
+
+    position_values = track['position'].to_numpy(dtype=object)
+    is_k = np.zeros((n_frames, n_slots), dtype=bool)
+    is_p = np.zeros((n_frames, n_slots), dtype=bool)
+    is_k[frame_idx, slot] = position_values == 'K'
+    is_p[frame_idx, slot] = position_values == 'P'
+
+    # Same kicker rule as compute_kicker_core_dist: 'K' if present, otherwise 'P'
+    kicker_slot = np.where(is_k.any(axis=1), _first_slot(is_k), _first_slot(is_p))
+    ball_slot = _first_slot(team == FOOTBALL)
+
+    frames = track.iloc[starts][['gameId', 'playId', 'frameId', 'event']].reset_index(drop=True)
+
+    return FrameBlocks(frames, xy, team, nfl_id, kicker_slot, ball_slot)
+
+def reference_slots(blocks, ref='kicker'):
+    '''
+    Slot of the reference entity in every frame.
+
+    Parameters:
+    -----------
+    blocks - FrameBlocks
+    ref - 'kicker', 'ball' or an nflId
+
+    Returns:
+    --------
+    ref_slot - (n_frames,) slot of the reference, -1 where it is not on the field
+    '''
+    if ref == 'kicker':
+        return blocks.kicker_slot
+    if ref == 'ball':
+        return blocks.ball_slot
+
+    return _first_slot(blocks.nfl_id == ref)
+
+def opponent_team(blocks, ref='kicker'):
+    '''
+    Team code of the opponents of the reference in every frame. For the ball the
+    opponents are those of the kicking team.
+
+    Returns:
+    --------
+    opp - (n_frames,) team code, -1 where it cannot be determined
+    '''
+    rows = np.arange(len(blocks))
+    slot = blocks.kicker_slot if ref in ('kicker', 'ball') else reference_slots(blocks, ref)
+
+    own = np.where(slot >= 0, blocks.team[rows, np.maximum(slot, 0)], -1)
+
+    return np.select([own == HOME, own == AWAY], [AWAY, HOME], default=-1)
+
+def opponent_distances(blocks, ref='kicker'):
+    '''
+    Distance from the reference to every slot, with non-opponents set to inf.
+
+    Parameters:
+    -----------
+    blocks - FrameBlocks
+    ref - 'kicker', 'ball' or an nflId
+
+    Returns:
+    --------
+    dist - (n_frames, n_slots) float32 distances in yards
+    '''
+    rows = np.arange(len(blocks))
+    slot = reference_slots(blocks, ref)
+    opp = opponent_team(blocks, ref)
+
+    ref_xy = blocks.xy[rows, np.maximum(slot, 0)]
+    dist = np.sqrt(np.square(blocks.xy - ref_xy[:, None, :]).sum(axis=2))
+
+    valid = (blocks.team == opp[:, None]) & (slot >= 0)[:, None] & (opp >= 0)[:, None]
+
+    return np.where(valid & ~np.isnan(dist), dist, np.inf).astype(np.float32)
+
+def iter_pairwise_distances(blocks, chunk_size=10000):
+    '''
+    All entity-to-entity distances per frame, generated one chunk of frames at a time so
+    only chunk_size x n_slots x n_slots values are held at once (e.g. for blocking features
+    reduced per chunk).
+
+    Parameters:
+    -----------
+    blocks - FrameBlocks
+    chunk_size - number of frames per chunk
+
+    Yields:
+    -------
+    start, dist - index of the first frame of the chunk in blocks.frames and the
+                  (chunk frames, n_slots, n_slots) float32 distances, NaN for empty slots
+    '''
+    for start in range(0, len(blocks), chunk_size):
+        xy = blocks.xy[start:start+chunk_size]
+        diff = xy[:, :, None, :] - xy[:, None, :, :]
+        yield start, np.sqrt(np.square(diff).sum(axis=3))
+
+def opponents_within(blocks, r, ref='kicker'):
+    '''
+    Number of opponents within r yards of the reference in every frame.
+
+    Parameters:
+    -----------
+    blocks - FrameBlocks
+    r - radius in yards
+    ref - 'kicker', 'ball' or an nflId
+
+    Returns:
+    --------
+    counts - blocks.frames with an added 'opponents_within_{r}' column
+    '''
+    counts = blocks.frames.copy()
+    counts[f'opponents_within_{r}'] = (opponent_distances(blocks, ref) <= r).sum(axis=1)
+
+    return counts
+
+def k_nearest_opponents(blocks, k=5, ref='kicker'):
+    '''
+    Distances to the k nearest opponents of the reference in every frame. The k-th column
+    at the kick frame is the kicker core distance.
+
+    Parameters:
+    -----------
+    blocks - FrameBlocks
+    k - number of nearest opponents
+    ref - 'kicker', 'ball' or an nflId
+
+    Returns:
+    --------
+    nearest - blocks.frames with added columns 'opp_dist_1' ... 'opp_dist_{k}' (NaN when
+              fewer than k opponents are tracked)
+    '''
+    dist = opponent_distances(blocks, ref)
+    k_eff = min(k, dist.shape[1])
+
+    smallest = np.sort(np.partition(dist, k_eff - 1, axis=1)[:, :k_eff], axis=1)
+    smallest[np.isinf(smallest)] = np.nan
+
+    nearest = blocks.frames.copy()
+    for i in range(k):
+        nearest[f'opp_dist_{i+1}'] = smallest[:, i] if i < k_eff else np.nan
+
+    return nearest
+
+def event_frame_ids(blocks, event):
+    '''
+    First frameId at which event occurs for every play in blocks.
+
+    Returns:
+    --------
+    event_frames - series indexed by (gameId, playId)
+    '''
+    frames = blocks.frames
+
+    return frames[frames['event'] == event].groupby(['gameId', 'playId'])['frameId'].min()
+
+def pressure_count(blocks, r, event, before=10, after=0, ref='kicker'):
+    '''
+    Opponent pressure over the window of frames around an event for every play.
+
+    Parameters:
+    -----------
+    blocks - FrameBlocks
+    r - radius in yards
+    event - event defining the window, e.g. 'field_goal_attempt'
+    before, after - number of frames before/after the event frame in the window
+    ref - 'kicker', 'ball' or an nflId
+
+    Returns:
+    --------
+    pressure - dataframe indexed by (gameId, playId) with 'max_pressure', 'mean_pressure'
+               and 'event_pressure' (count at the event frame)
+    '''
+    counts = opponents_within(blocks, r, ref)
+    col = f'opponents_within_{r}'
+
+    event_frames = event_frame_ids(blocks, event).rename('event_frame')
+    counts = counts.join(event_frames, on=['gameId', 'playId'], how='inner')
+
+    offset = counts['frameId'] - counts['event_frame']
+    window = counts[(offset >= -before) & (offset <= after)]
+
+    grouped = window.groupby(['gameId', 'playId'])[col]
+    pressure = pd.DataFrame({
+        'max_pressure': grouped.max(),
+        'mean_pressure': grouped.mean(),
+        'event_pressure': window[window['frameId'] == window['event_frame']].groupby(['gameId', 'playId'])[col].first(),
+    })
+
+    return pressure
@@ -1,4 +1,15 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from pipeline.schema import TRACKING_DTYPES, TRACKING_NA_VALUES, concat_frames
+
 def get_play(game_id, play_id, tracking):
+    # Out-of-core datasets read only the requested play from disk
+    if isinstance(tracking, TrackingDataset):
+        return tracking.get_play(game_id, play_id)
+
     game = tracking[tracking['gameId'] == game_id]
     play = game[game['playId'] == play_id]
     return play
@@ -40,4 +51,334 @@ def get_event(game_id, play_id, track_fp, event):
         
     #frame_id = play_ex.loc[event_index]['frameId']
     
-    return event_df, event_index
\ No newline at end of file
+    return event_df, event_index
+
+def orient_play_direction(track):
+    '''
+    Re-orient direction of play by offensive team direction, in place.
+
+    We must reorient this to reflect movement in the offense direction instead of the on-field coordinates
+    (reorient the origin from the bottom left to top right for a change in direction).
+    Note that we have 160/3 for the y direction since the football field is 160ft, but our units are yards.
+
+    Parameters:
+    -----------
+    track - tracking dataframe with 'playDirection', 'x' and 'y' columns
+
+    Returns:
+    --------
+    track - the same dataframe with re-oriented coordinates
+    '''
+    left = track['playDirection'] == 'left'
+    track.loc[left, 'x'] = 120 - track.loc[left, 'x']
+    track.loc[left, 'y'] = 160/3 - track.loc[left, 'y']
+
+    return track
+
+def _relabel(play):
+    # Consecutive labels for the rows of a play, starting at its first row in the file
+    play = play.copy()
+    play.index = pd.RangeIndex(play.index[0], play.index[0] + len(play)) if len(play) else pd.RangeIndex(0)
+    return play
+
+def _line_offsets(path, lines, block_size=2**26):
+    '''
+    Byte offsets of the given (sorted, 0-based) line numbers of a text file, found by
+    counting newlines block by block.
+    '''
+    lines = np.asarray(lines, dtype=np.int64)
+    offsets = np.empty(len(lines), dtype=np.int64)
+
+    found = 0
+    if found < len(lines) and lines[0] == 0:
+        offsets[0] = 0
+        found = 1
+
+    line = 0
+    position = 0
+    with open(path, 'rb') as f:
+        while found < len(lines):
+            block = f.read(block_size)
+            if not block:
+                break
+
+            # Line line+1+i starts right after the i-th newline of the block
+            starts = position + np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == ord('\n')) + 1
+            wanted = lines[found:]
+            wanted = wanted[wanted <= line + len(starts)]
+            offsets[found:found + len(wanted)] = starts[wanted - line - 1]
+
+            found += len(wanted)
+            line += len(starts)
+            position += len(block)
+
+    return [int(offset) for offset in offsets[:found]]
+
+class TrackingDataset:
+    '''
+    Lazy view of the raw tracking files that never holds more than one chunk (or one play)
+    in memory. Season, play type, gameId and column selections are pushed down to the
+    reader: only the files of the selected seasons are opened, only the selected columns
+    are parsed, and rows of other plays are discarded chunk by chunk.
+
+    A TrackingDataset can be passed wherever a tracking dataframe is passed to get_play
+    (and so get_event and the feature functions built on it). With display_names=['football']
+    and orient=True it stands in for track_fp (the output of preprocess_football_track, whose
+    coordinates preprocess_tracking re-oriented to the offense direction; without orient the
+    coordinates of left-direction plays differ). The rows of a play are labelled consecutively
+    (starting at the play's first row in the file), so index arithmetic such as get_event's
+    index-5:index+5 and idxmax differences gives the same results as on the in-memory dataframe.
+
+    Rows of a play are assumed to be contiguous in each file, as in the Big Data Bowl
+    trackingYYYY.csv files.
+
+    Parameters:
+    -----------
+    data_dir - directory with trackingYYYY.csv (or trackingYYYY.parquet) and plays.csv
+    seasons - seasons to include
+    play_type - optional specialTeamsPlayType to keep, e.g. 'Field Goal' (uses plays.csv)
+    game_ids - optional iterable of gameIds to keep
+    display_names - optional iterable of displayName values to keep, e.g. ['football']
+    columns - optional list of columns to read (gameId, playId and frameId are always read)
+    plays - optional play dataframe to use for play_type instead of reading plays.csv
+    orient - re-orient coordinates to the offense direction as in preprocess_tracking, required
+             to match the preprocessed tracking dataframes
+    chunksize - number of csv rows parsed at a time
+    '''
+
+    KEY_COLUMNS = ['gameId', 'playId', 'frameId']
+
+    def __init__(self, data_dir, seasons=(2018, 2019, 2020), play_type=None, game_ids=None,
+                 display_names=None, columns=None, plays=None, orient=False, chunksize=1000000):
+        self.data_dir = data_dir
+        self.seasons = list(seasons)
+        self.play_type = play_type
+        self.game_ids = None if game_ids is None else set(game_ids)
+        self.display_names = None if display_names is None else list(display_names)
+        self.orient = orient
+        self.chunksize = chunksize
+        self._plays = plays
+        self._play_keys = None
+        self._index = None
+        self._headers = {}
+
+        if columns is None:
+            self.columns = None
+        else:
+            extra = ['playDirection', 'x', 'y'] if orient else []
+            extra += ['displayName'] if display_names is not None else []
+            self.columns = list(dict.fromkeys(self.KEY_COLUMNS + list(columns) + extra))
+
+    def _files(self):
+        # Only the files of the selected seasons are ever opened
+        for season in self.seasons:
+            for ext in ('.parquet', '.csv'):
+                path = os.path.join(self.data_dir, f'tracking{season}{ext}')
+                if os.path.exists(path):
+                    yield path
+                    break
+            else:
+                raise FileNotFoundError(f'No tracking file for season {season} in {self.data_dir}')
+
+    def _selected_plays(self):
+        # (gameId, playId) pairs of the requested play type, None if not filtering on it
+        if self.play_type is None:
+            return None
+
+        if self._play_keys is None:
+            plays = self._plays
+            if plays is None:
+                plays = pd.read_csv(os.path.join(self.data_dir, 'plays.csv'),
+                                    usecols=['gameId', 'playId', 'specialTeamsPlayType'])
+            plays = plays[plays['specialTeamsPlayType'] == self.play_type]
+            self._play_keys = pd.MultiIndex.from_frame(plays[['gameId', 'playId']].astype(np.int64))
+
+        return self._play_keys
+
+    def _dtypes(self, columns=None):
+        columns = self.columns if columns is None else columns
+        return {col: dtype for col, dtype in TRACKING_DTYPES.items() if columns is None or col in columns}
+
+    def _filter(self, chunk):
+        mask = np.ones(len(chunk), dtype=bool)
+
+        if self.game_ids is not None:
+            mask &= chunk['gameId'].isin(self.game_ids).to_numpy()
+
+        if self.display_names is not None:
+            mask &= chunk['displayName'].isin(self.display_names).to_numpy()
+
+        play_keys = self._selected_plays()
+        if play_keys is not None:
+            keys = pd.MultiIndex.from_arrays([chunk['gameId'].astype(np.int64), chunk['playId'].astype(np.int64)])
+            mask &= keys.isin(play_keys)
+
+        chunk = chunk[mask]
+
+        if self.orient and len(chunk):
+            chunk = orient_play_direction(chunk.copy())
+
+        return chunk
+
+    def _read_file(self, path, columns=None):
+        # Stream raw chunks of one file, keeping row positions in the file as the index
+        columns = self.columns if columns is None else columns
+
+        if path.endswith('.parquet'):
+            import pyarrow.parquet as pq
+
+            start = 0
+            for batch in pq.ParquetFile(path).iter_batches(batch_size=self.chunksize, columns=columns):
+                chunk = batch.to_pandas()
+                chunk.index = pd.RangeIndex(start, start + len(chunk))
+                start += len(chunk)
+                yield chunk.astype(self._dtypes(columns))
+        else:
+            yield from pd.read_csv(path, usecols=columns, dtype=self._dtypes(columns), chunksize=self.chunksize,
+                                   keep_default_na=False, na_values=TRACKING_NA_VALUES)
+
+    def iter_chunks(self):
+        '''
+        Generator over filtered chunks of the selected tracking rows.
+        '''
+        for path in self._files():
+            for chunk in self._read_file(path):
+                chunk = self._filter(chunk)
+                if len(chunk):
+                    yield chunk
+
+    def iter_plays(self):
+        '''
+        Generator over the selected plays, one at a time.
+
+        Yields:
+        -------
+        (game_id, play_id), play - the key and tracking rows of a single play
+        '''
+        carry = None
+
+        for chunk in self.iter_chunks():
+            if carry is not None:
+                chunk = concat_frames([carry, chunk])
+
+            keys = chunk[['gameId', 'playId']].to_numpy()
+            new_play = np.ones(len(chunk), dtype=bool)
+            new_play[1:] = (keys[1:] != keys[:-1]).any(axis=1)
+            starts = np.append(np.flatnonzero(new_play), len(chunk))
+
+            # The last play of the chunk may continue in the next one
+            for start, stop in zip(starts[:-2], starts[1:-1]):
+                yield (int(keys[start, 0]), int(keys[start, 1])), _relabel(chunk.iloc[start:stop])
+
+            carry = chunk.iloc[starts[-2]:]
+
+        if carry is not None and len(carry):
+            yield (int(carry['gameId'].iloc[0]), int(carry['playId'].iloc[0])), _relabel(carry)
+
+    def iter_frames(self):
+        '''
+        Generator over the frames of the selected plays, one at a time.
+
+        Yields:
+        -------
+        (game_id, play_id, frame_id), frame - the key and tracking rows of a single frame
+        '''
+        for (game_id, play_id), play in self.iter_plays():
+            for frame_id, frame in play.groupby('frameId', sort=True, observed=True):
+                yield (game_id, play_id, int(frame_id)), frame
+
+    def build_index(self):
+        '''
+        Scan only the key columns of the selected files once and record the row range of
+        every play (and for csv files the byte offset of its first row), so get_play can
+        seek straight to a single play without scanning the files again.
+
+        Returns:
+        --------
+        index - dict of (gameId, playId) to a list of (path, start, stop, offset) row ranges,
+                offset is None for parquet files
+        '''
+        index = {}
+
+        for path in self._files():
+            for chunk in self._read_file(path, columns=['gameId', 'playId']):
+                keys = chunk[['gameId', 'playId']].to_numpy()
+                rows = chunk.index.to_numpy()
+
+                new_play = np.ones(len(chunk), dtype=bool)
+                new_play[1:] = (keys[1:] != keys[:-1]).any(axis=1)
+                starts = np.flatnonzero(new_play)
+                stops = np.append(starts[1:], len(chunk))
+
+                for start, stop in zip(starts, stops):
+                    key = (int(keys[start, 0]), int(keys[start, 1]))
+                    ranges = index.setdefault(key, [])
+
+                    # Merge with the previous range when a play spans two chunks
+                    if ranges and ranges[-1][0] == path and ranges[-1][2] == rows[start]:
+                        ranges[-1] = (path, ranges[-1][1], int(rows[stop - 1]) + 1, None)
+                    else:
+                        ranges.append((path, int(rows[start]), int(rows[stop - 1]) + 1, None))
+
+        # Byte offsets of the first row of every play, found in one more pass over each csv
+        for path in self._files():
+            if path.endswith('.parquet'):
+                continue
+
+            file_ranges = [(key, i) for key, ranges in index.items() for i, r in enumerate(ranges) if r[0] == path]
+            file_ranges.sort(key=lambda key_i: index[key_i[0]][key_i[1]][1])
+            offsets = _line_offsets(path, [index[key][i][1] + 1 for key, i in file_ranges])
+
+            for (key, i), offset in zip(file_ranges, offsets):
+                path, start, stop, _ = index[key][i]
+                index[key][i] = (path, start, stop, offset)
+
+        self._index = index
+
+        return index
+
+    def get_play(self, game_id, play_id):
+        '''
+        Read the tracking rows of a single play (the out-of-core get_play).
+
+        Returns:
+        --------
+        play - tracking rows of the play, empty if the play is not in the dataset
+        '''
+        if self._index is None:
+            self.build_index()
+
+        parts = []
+        for path, start, stop, offset in self._index.get((int(game_id), int(play_id)), []):
+            if path.endswith('.parquet'):
+                part = pd.read_parquet(path, columns=self.columns,
+                                       filters=[('gameId', '==', game_id), ('playId', '==', play_id)])
+                part.index = pd.RangeIndex(start, stop)
+                part = part.astype(self._dtypes())
+            else:
+                if path not in self._headers:
+                    self._headers[path] = pd.read_csv(path, nrows=0).columns
+
+                # Seek straight to the play's first row instead of parsing the rows before it
+                with open(path, 'rb') as f:
+                    f.seek(offset)
+                    part = pd.read_csv(f, header=None, names=self._headers[path], usecols=self.columns,
+                                       dtype=self._dtypes(), nrows=stop - start,
+                                       keep_default_na=False, na_values=TRACKING_NA_VALUES)
+                part.index = pd.RangeIndex(start, stop)
+            parts.append(self._filter(part))
+
+        if not parts:
+            columns = self.columns if self.columns is not None else list(TRACKING_DTYPES)
+            return pd.DataFrame(columns=columns)
+
+        return _relabel(concat_frames(parts))
+
+    def to_frame(self):
+        '''
+        Load the whole (filtered) selection into memory, e.g. after narrowing it down to
+        a play type and a few columns.
+        '''
+        chunks = list(self.iter_chunks())
+
+        return concat_frames(chunks) if chunks else pd.DataFrame(columns=self.columns)
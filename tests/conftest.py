@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+EVENTS = {'Extra Point': 'extra_point_attempt', 'Field Goal': 'field_goal_attempt'}
+
+def make_season(season, n_plays=6, n_frames=30, kick_frame=12, seed=0):
+    '''
+    Synthetic tracking and play data in the layout of the Big Data Bowl files: 22 players
+    and the football per frame, alternating extra points and field goals, the ball at rest
+    until kick_frame and then moving downfield on a slight curve.
+    '''
+    rng = np.random.default_rng(seed)
+    track_rows, play_rows = [], []
+
+    for p in range(n_plays):
+        game_id = season * 1000000 + p // 3
+        play_id = 100 + p
+        play_type = 'Extra Point' if p % 2 == 0 else 'Field Goal'
+        direction = 'left' if p % 3 == 0 else 'right'
+
+        play_rows.append({'gameId': game_id, 'playId': play_id, 'specialTeamsPlayType': play_type,
+                          'specialTeamsResult': 'Kick Attempt Good', 'kickerId': 1.0})
+
+        for frame_id in range(1, n_frames + 1):
+            t = max(0, frame_id - kick_frame)
+            event = {1: 'ball_snap', kick_frame: EVENTS[play_type]}.get(frame_id, 'None')
+
+            track_rows.append({'gameId': game_id, 'playId': play_id, 'frameId': frame_id,
+                               'nflId': np.nan, 'displayName': 'football', 'team': 'football',
+                               'position': np.nan, 'x': 95 + 2.5 * t + rng.normal(0, 0.05),
+                               'y': 26.6 + 0.05 * t + 0.01 * t * t, 's': 25.0 if t else 0.5,
+                               'event': event, 'playDirection': direction})
+
+            for j in range(22):
+                track_rows.append({'gameId': game_id, 'playId': play_id, 'frameId': frame_id,
+                                   'nflId': float(j + 1), 'displayName': f'player{j}',
+                                   'team': 'home' if j < 11 else 'away',
+                                   'position': 'K' if j == 0 else ('P' if j == 1 else 'LS'),
+                                   'x': 90 + 0.5 * j + 0.1 * frame_id + rng.normal(0, 0.1),
+                                   'y': 20 + 0.7 * j, 's': 1 + 0.1 * j, 'event': event,
+                                   'playDirection': direction})
+
+    return pd.DataFrame(track_rows), pd.DataFrame(play_rows)
+
+@pytest.fixture
+def data_dir(tmp_path):
+    # trackingYYYY.csv files for three seasons and plays.csv
+    plays = []
+    for season, seed in ((2018, 0), (2019, 1), (2020, 2)):
+        track, play_df = make_season(season, seed=seed)
+        track.to_csv(tmp_path / f'tracking{season}.csv', index=False)
+        plays.append(play_df)
+
+    pd.concat(plays).to_csv(tmp_path / 'plays.csv', index=False)
+
+    return tmp_path
@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from pipeline.feature_engineering import fit_kick_trajectories, kick_trajectory
+
+EVENT = 'field_goal_attempt'
+
+def kicks(n_kicks, hook=0.0, noise=0.05, seed=0, kick_frame=6, n_frames=40):
+    '''
+    Football tracking for n_kicks kicks from x=75 at 25 yards/s, at rest until kick_frame.
+    y drifts at a random angle plus a hook of 0.5*hook*t^2 yards and normal noise.
+
+    Returns:
+    --------
+    track_fp - football tracking dataframe
+    crossing - true y at x=120 per play, indexed by (gameId, playId)
+    '''
+    rng = np.random.default_rng(seed)
+    rows, crossing = [], {}
+
+    for play_id in range(n_kicks):
+        y0, vy = rng.uniform(20, 33), rng.uniform(-2, 2)
+        t = np.maximum(np.arange(1, n_frames + 1) - kick_frame, 0) / 10
+
+        x = 75 + 25 * t + rng.normal(0, noise, n_frames)
+        y = y0 + vy * t + 0.5 * hook * t**2 + rng.normal(0, noise, n_frames)
+        s = np.where(t > 0, 25.0, 0.0)
+        event = np.where(np.arange(1, n_frames + 1) == kick_frame, EVENT, 'None')
+
+        rows.append(pd.DataFrame({'gameId': 1, 'playId': play_id, 'frameId': np.arange(1, n_frames + 1),
+                                  'x': x, 'y': y, 's': s, 'event': event}))
+
+        t_cross = 45 / 25
+        crossing[(1, play_id)] = y0 + vy * t_cross + 0.5 * hook * t_cross**2
+
+    return pd.concat(rows, ignore_index=True), pd.Series(crossing)
+
+def test_straight_kick_projection():
+    track_fp, crossing = kicks(200)
+    fits = fit_kick_trajectories(track_fp, EVENT)
+
+    error = fits['endzone_y_expected'] - crossing.reindex(fits.index)
+
+    # Well inside the 3.08 yard half-width of the uprights
+    assert error.abs().max() < 0.75
+    assert error.std() < 0.3
+    assert (fits['kick_fit_frames'] == 7).all()
+
+@pytest.mark.parametrize('hook', [-3.0, 3.0])
+def test_curved_kick_projection(hook):
+    track_fp, crossing = kicks(100, hook=hook, seed=1)
+    fits = fit_kick_trajectories(track_fp, EVENT)
+
+    # The expected crossing follows the straight line the kick leaves on, so the hook shows
+    # up as the difference to the actual crossing rather than in the expectation
+    deviation = crossing.reindex(fits.index) - fits['endzone_y_expected']
+
+    assert (np.sign(deviation) == np.sign(hook)).mean() > 0.95
+    assert abs(deviation.mean()) > 1.5
+    assert (np.sign(fits['kick_curvature']) == np.sign(hook)).mean() > 0.9
+
+def test_kick_trajectory_columns():
+    track_fp, _ = kicks(5)
+    pt_play = pd.DataFrame({'gameId': 1, 'playId': range(6), 'endzone_y_expected': 0.0})
+
+    pt_play = kick_trajectory(pt_play, track_fp, EVENT)
+
+    assert list(pt_play.columns) == ['gameId', 'playId', 'endzone_y_expected', 'kick_fit_residual', 'kick_curvature']
+    assert pt_play['endzone_y_expected'].iloc[:5].between(10, 45).all()
+    assert np.isnan(pt_play['endzone_y_expected'].iloc[5])
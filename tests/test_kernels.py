@@ -0,0 +1,146 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from pipeline import kernels
+from pipeline.feature_engineering import compute_endzone_y_pos, compute_kicker_core_dist
+from pipeline.kernels import (endzone_y_kernel, idx_diff_kernel, kth_smallest_kernel, endzone_y_batch,
+                              kick_attempt_idx_diff, kicker_core_dist_batch)
+from pipeline.preprocessing import football_track, get_kick_attempt_idx_diff
+from pipeline.schema import apply_schema
+
+from conftest import EVENTS, make_season
+
+BACKENDS = ['numpy', pytest.param('numba', marks=pytest.mark.skipif(kernels.numba is None,
+                                                                      reason='numba is not installed'))]
+
+# Segment lengths with empty segments at the start, middle and end and segments shorter than k
+LENGTHS = [0, 5, 1, 0, 2, 8, 3, 0]
+
+def segments(seed=0):
+    rng = np.random.default_rng(seed)
+    offsets = np.concatenate([[0], np.cumsum(LENGTHS)]).astype(np.int64)
+    n = offsets[-1]
+
+    # Ball x around the fieldgoal lines so some plays have 0, 1 or several in-bounds frames
+    x = rng.choice([0.5, 60.0, 119.0, 121.5, 125.0], size=n)
+    y = rng.uniform(0, 53.3, size=n)
+    s = rng.uniform(0, 30, size=n)
+    s[rng.random(n) < 0.2] = np.nan
+    is_event = rng.random(n) < 0.3
+
+    return offsets, x, y, s, is_event
+
+def reference_endzone_y(x, y):
+    within = y[(118 < x) & (x < 122) | (-2 < x) & (x < 2)]
+    if len(within) == 0:
+        return np.nan
+    id1 = len(within) // 2 - 1
+    id2 = len(within) // 2 if len(within) % 2 == 0 else len(within) // 2 - 1
+    return (within[id1] + within[id2]) / 2
+
+def reference_idx_diff(is_event, s):
+    if not is_event.any() or np.isnan(s).all():
+        return np.nan
+    return abs(np.flatnonzero(is_event)[0] - int(np.nanargmax(s)))
+
+def reference_kth(values, k):
+    return np.sort(values)[k - 1] if len(values) >= k else np.nan
+
+@pytest.mark.parametrize('backend', BACKENDS)
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_endzone_y_kernel(backend, seed):
+    offsets, x, y, _, _ = segments(seed)
+    expected = [reference_endzone_y(x[a:b], y[a:b]) for a, b in zip(offsets[:-1], offsets[1:])]
+
+    np.testing.assert_array_equal(endzone_y_kernel(x, y, offsets, backend), expected)
+
+@pytest.mark.parametrize('backend', BACKENDS)
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_idx_diff_kernel(backend, seed):
+    offsets, _, _, s, is_event = segments(seed)
+    expected = [reference_idx_diff(is_event[a:b], s[a:b]) for a, b in zip(offsets[:-1], offsets[1:])]
+
+    np.testing.assert_array_equal(idx_diff_kernel(is_event, s, offsets, backend), expected)
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_idx_diff_kernel_without_event(backend):
+    offsets = np.array([0, 4, 4], dtype=np.int64)
+    s = np.array([1.0, np.nan, 3.0, 2.0])
+
+    np.testing.assert_array_equal(idx_diff_kernel(np.zeros(4, dtype=bool), s, offsets, backend), [np.nan, np.nan])
+
+@pytest.mark.parametrize('backend', BACKENDS)
+@pytest.mark.parametrize('k', [1, 3, 5])
+def test_kth_smallest_kernel(backend, k):
+    offsets, _, _, s, _ = segments(0)
+    expected = [reference_kth(s[a:b], k) for a, b in zip(offsets[:-1], offsets[1:])]
+
+    np.testing.assert_array_equal(kth_smallest_kernel(s, offsets, k, backend), expected)
+
+@pytest.mark.skipif(kernels.numba is None, reason='numba is not installed')
+@pytest.mark.parametrize('k', [1, 3])
+def test_backends_agree(k):
+    offsets, x, y, s, is_event = segments(3)
+
+    np.testing.assert_array_equal(endzone_y_kernel(x, y, offsets, 'numba'), endzone_y_kernel(x, y, offsets, 'numpy'))
+    np.testing.assert_array_equal(idx_diff_kernel(is_event, s, offsets, 'numba'), idx_diff_kernel(is_event, s, offsets, 'numpy'))
+    np.testing.assert_array_equal(kth_smallest_kernel(s, offsets, k, 'numba'), kth_smallest_kernel(s, offsets, k, 'numpy'))
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_empty_input(backend):
+    empty = np.array([], dtype=np.float64)
+    offsets = np.array([0], dtype=np.int64)
+
+    assert len(endzone_y_kernel(empty, empty, offsets, backend)) == 0
+    assert len(idx_diff_kernel(empty.astype(bool), empty, offsets, backend)) == 0
+    assert len(kth_smallest_kernel(empty, offsets, 3, backend)) == 0
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        endzone_y_kernel([], [], [0], backend='cuda')
+
+@pytest.fixture
+def field_goals():
+    track, plays = make_season(2018, n_plays=8, kick_frame=10)
+    track = apply_schema(track)
+
+    # A play without the kick attempt event
+    missing = track['playId'] == 101
+    track['event'] = track['event'].astype(str).where(~missing, 'None').astype('category')
+
+    pt_play = plays[plays['specialTeamsPlayType'] == 'Field Goal'].reset_index(drop=True)
+    tracking = track.merge(pt_play[['gameId', 'playId']])
+    track_fp = football_track(tracking).reset_index(drop=True)
+
+    return pt_play, tracking, track_fp, EVENTS['Field Goal']
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_endzone_y_batch_matches_compute_endzone_y_pos(field_goals, backend):
+    pt_play, _, track_fp, _ = field_goals
+    expected = [compute_endzone_y_pos(g, p, track_fp) for g, p in zip(pt_play['gameId'], pt_play['playId'])]
+
+    np.testing.assert_allclose(endzone_y_batch(pt_play.copy(), track_fp, backend)['endzone_y'], expected)
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_kick_attempt_idx_diff_matches_get_kick_attempt_idx_diff(field_goals, backend):
+    pt_play, _, track_fp, event = field_goals
+    expected = [get_kick_attempt_idx_diff(g, p, track_fp, event) for g, p in zip(pt_play['gameId'], pt_play['playId'])]
+
+    idx_diff = kick_attempt_idx_diff(pt_play, track_fp, event, backend)
+
+    assert idx_diff.isna().sum() == 1
+    np.testing.assert_array_equal(idx_diff, expected)
+
+@pytest.mark.parametrize('backend', BACKENDS)
+@pytest.mark.parametrize('k', [1, 3])
+def test_kicker_core_dist_batch_matches_compute_kicker_core_dist(field_goals, backend, k):
+    pt_play, tracking, track_fp, event = field_goals
+    core = kicker_core_dist_batch(pt_play.copy(), tracking, track_fp, event, k, backend)[f'kicker_core_dist_{k}']
+
+    for (g, p), value in zip(zip(pt_play['gameId'], pt_play['playId']), core):
+        if event not in track_fp.loc[(track_fp['gameId'] == g) & (track_fp['playId'] == p), 'event'].values:
+            # compute_kicker_core_dist needs the event, the batch version leaves the play out
+            assert np.isnan(value)
+        else:
+            assert np.isclose(value, compute_kicker_core_dist(g, p, tracking, track_fp, event, k))
@@ -0,0 +1,98 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from pipeline.preprocessing import ball_tracking_anomalies, preprocess_ep, fit_scaling, apply_scaling
+
+def kick(play_id=1, n_rest=10, n_flight=15, step=2.5, speed=25.0):
+    # Ball at rest for n_rest frames, then kicked downfield at step yards per frame
+    x = np.r_[np.full(n_rest, 30.0), 30 + step * np.arange(1, n_flight + 1)]
+    s = np.r_[np.zeros(n_rest - 1), speed, np.full(n_flight, speed)]
+
+    return pd.DataFrame({'gameId': 1, 'playId': play_id, 'frameId': np.arange(1, len(x) + 1),
+                         'x': x, 'y': np.full(len(x), 26.65), 's': s})
+
+def test_clean_kick():
+    quality, mask = ball_tracking_anomalies(kick())
+
+    assert quality['quality_score'].iloc[0] == 1.0
+    assert mask.all()
+    # The kick itself is the largest acceleration, 2.5 yards in one frame
+    assert np.isclose(quality['max_acceleration'].iloc[0], 250)
+
+@pytest.mark.parametrize('frame_id', [5, 18])
+def test_misplaced_frame(frame_id):
+    # One frame moved 2 yards out of line, at rest and in flight
+    track_fp = kick()
+    track_fp.loc[track_fp['frameId'] == frame_id, 'y'] += 2
+
+    quality, mask = ball_tracking_anomalies(track_fp)
+
+    # Only the misplaced frame has an impossible acceleration, not its neighbours
+    assert quality['impossible_acceleration'].iloc[0] == 1
+    assert not mask[track_fp['frameId'] == frame_id].any()
+    assert quality['max_acceleration'].iloc[0] >= 400
+
+def test_frozen_ball():
+    # Ball stuck for three frames in flight while 's' says it is moving
+    track_fp = kick()
+    stuck = track_fp['frameId'].between(15, 17)
+    track_fp.loc[stuck, 'x'] = track_fp.loc[track_fp['frameId'] == 15, 'x'].iloc[0]
+
+    quality, _ = ball_tracking_anomalies(track_fp)
+
+    assert quality['frozen'].iloc[0] == 1
+    assert quality['quality_score'].iloc[0] < 1
+
+def test_sharp_deceleration():
+    # Ball already in flight at the first frame stops dead, the only acceleration is the
+    # deceleration, which max_acceleration reports
+    track_fp = kick(n_rest=1)
+    track_fp.loc[track_fp['frameId'] > 10, 'x'] = track_fp.loc[track_fp['frameId'] == 10, 'x'].iloc[0]
+    track_fp.loc[track_fp['frameId'] > 10, 's'] = 0
+
+    quality, _ = ball_tracking_anomalies(track_fp)
+
+    assert np.isclose(quality['max_acceleration'].iloc[0], 250)
+
+def test_plays_are_separate():
+    # The last frame of one play and the first frame of the next are never differenced
+    track_fp = pd.concat([kick(1), kick(2, n_rest=5)], ignore_index=True)
+    track_fp.loc[track_fp['playId'] == 2, 'x'] += 50
+
+    quality, _ = ball_tracking_anomalies(track_fp)
+
+    assert (quality['quality_score'] == 1.0).all()
+    assert list(quality['n_frames']) == [25, 20]
+
+def ep_table(n=12, seed=0):
+    rng = np.random.default_rng(seed)
+    numeric = ['yardlineNumber', 'gameClockSeconds', 'penaltyYards', 'preSnapHomeScore', 'preSnapVisitorScore',
+               'kicker_height', 'kicker_weight', 'endzone_y', 'endzone_y_error', 'endzone_y_off_center',
+               'kicker_core_dist_1']
+    table = pd.DataFrame(rng.normal(size=(n, len(numeric))), columns=numeric)
+    table['specialTeamsResult'] = rng.choice(['Kick Attempt Good', 'Kick Attempt No Good'], size=n)
+    table['penaltyCodes'] = rng.choice(['no penalty', 'DH'], size=n)
+
+    # Plays dropped for missing values
+    table.loc[[0, 5], 'endzone_y'] = np.nan
+
+    return table
+
+def test_preprocess_ep_uses_fit_scaling():
+    ep_scale, ep_df = preprocess_ep(ep_table())
+    scale, encoders = fit_scaling(ep_df)
+
+    pd.testing.assert_frame_equal(ep_scale, apply_scaling(ep_df, scale, encoders))
+    assert len(ep_scale) == 10
+
+    # New plays with an unseen category
+    new = ep_df.copy()
+    new['penaltyCodes'] = 'OH'
+    assert (apply_scaling(new, scale, encoders)['penaltyCodes'] == -1).all()
+
+def test_preprocess_ep_without_encoding():
+    ep_scale, ep_df = preprocess_ep(ep_table(), encode_categorical=False)
+
+    assert list(ep_scale['specialTeamsResult']) == list(ep_df['specialTeamsResult'])
+    assert list(ep_scale['penaltyCodes']) == list(ep_df['penaltyCodes'])
@@ -0,0 +1,55 @@
+import os
+
+from pipeline.run import Stage, build_stages, run_stages, stage_keys
+
+def _read(path):
+    with open(path) as f:
+        return f.read()
+
+def _scale(text, factor):
+    return text * factor
+
+def toy_stages(path, factor=2):
+    return [
+        Stage('read', _read, [], {'path': str(path)}),
+        Stage('scale', _scale, ['read'], {'factor': factor}),
+    ]
+
+def started(capsys):
+    return [line.split()[-1] for line in capsys.readouterr().out.splitlines() if line.startswith('[start]')]
+
+def test_stage_keys_follow_settings_and_data(tmp_path):
+    keys = stage_keys(build_stages(str(tmp_path)))
+
+    assert keys == stage_keys(build_stages(str(tmp_path)))
+    assert keys['plays'] != stage_keys(build_stages(str(tmp_path / 'other')))['plays']
+
+    # Changing a season changes its branch downstream but not the other seasons
+    other = stage_keys(build_stages(str(tmp_path), seasons=(2018, 2019, 2021)))
+    assert other['tracking_2018'] == keys['tracking_2018']
+    assert other['ball_ep'] != keys['ball_ep']
+
+def test_resume_reruns_changed_stages(tmp_path, capsys):
+    data = tmp_path / 'data.txt'
+    data.write_text('ab')
+    checkpoint_dir = str(tmp_path / 'checkpoints')
+
+    run_stages(toy_stages(data), checkpoint_dir, workers=1)
+    assert started(capsys) == ['read', 'scale']
+
+    run_stages(toy_stages(data), checkpoint_dir, workers=1)
+    assert started(capsys) == []
+
+    run_stages(toy_stages(data, factor=3), checkpoint_dir, workers=1)
+    assert started(capsys) == ['scale']
+
+    # Same path, new contents
+    data.write_text('abc')
+    os.utime(data, ns=(0, 0))
+    run_stages(toy_stages(data, factor=3), checkpoint_dir, workers=1)
+    assert started(capsys) == ['read', 'scale']
+
+    other = tmp_path / 'other.txt'
+    other.write_text('abc')
+    run_stages(toy_stages(other, factor=3), checkpoint_dir, workers=1)
+    assert started(capsys) == ['read', 'scale']
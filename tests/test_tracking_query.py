@@ -0,0 +1,73 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from pipeline.feature_engineering import find_kickline
+from pipeline.preprocessing import get_kick_attempt_idx_diff, preprocess_football_track, preprocess_tracking_season
+from pipeline.schema import load_plays, load_tracking
+from querying.tracking_query import TrackingDataset, get_event, get_play
+
+from conftest import EVENTS
+
+SEASONS = (2018, 2019, 2020)
+
+def load_seasons(data_dir):
+    return [load_tracking(os.path.join(data_dir, f'tracking{season}.csv')) for season in SEASONS]
+
+def play_events(data_dir):
+    plays = pd.read_csv(os.path.join(data_dir, 'plays.csv'))
+    return {(g, p): EVENTS[t] for g, p, t in plays[['gameId', 'playId', 'specialTeamsPlayType']].itertuples(index=False)}
+
+@pytest.mark.parametrize('play_type', ['Extra Point', 'Field Goal'])
+@pytest.mark.parametrize('chunksize', [50, 1000000])
+def test_football_dataset_matches_track_fp(data_dir, play_type, chunksize):
+    # track_fp as built by the pipeline, re-oriented to the offense direction
+    play_df = load_plays(os.path.join(data_dir, 'plays.csv'))
+    track_fp = preprocess_football_track(*[preprocess_tracking_season(track, play_df, play_type)
+                                           for track in load_seasons(data_dir)])
+    assert (track_fp['playDirection'] == 'left').any()
+
+    dataset = TrackingDataset(data_dir, seasons=SEASONS, play_type=play_type, display_names=['football'],
+                              orient=True, chunksize=chunksize)
+
+    for (game_id, play_id), event in play_events(data_dir).items():
+        if event != EVENTS[play_type]:
+            continue
+
+        play = get_play(game_id, play_id, dataset)
+        assert (play['displayName'] == 'football').all()
+        np.testing.assert_allclose(play[['x', 'y']], get_play(game_id, play_id, track_fp)[['x', 'y']])
+
+        assert get_kick_attempt_idx_diff(game_id, play_id, dataset, event) == \
+            get_kick_attempt_idx_diff(game_id, play_id, track_fp, event)
+        assert np.isclose(find_kickline(game_id, play_id, dataset, event),
+                          find_kickline(game_id, play_id, track_fp, event))
+
+        event_df, _ = get_event(game_id, play_id, dataset, event)
+        expected_df, _ = get_event(game_id, play_id, track_fp, event)
+        np.testing.assert_array_equal(event_df['frameId'].to_numpy(), expected_df['frameId'].to_numpy())
+
+def test_get_play_matches_in_memory(data_dir):
+    tracking = pd.concat(load_seasons(data_dir), ignore_index=True)
+    dataset = TrackingDataset(data_dir, seasons=SEASONS, chunksize=100)
+
+    for game_id, play_id in play_events(data_dir):
+        play = get_play(game_id, play_id, dataset)
+        expected = get_play(game_id, play_id, tracking)
+
+        pd.testing.assert_frame_equal(play.reset_index(drop=True), expected.reset_index(drop=True),
+                                      check_categorical=False)
+
+def test_iter_plays_covers_play_type(data_dir):
+    dataset = TrackingDataset(data_dir, seasons=SEASONS, play_type='Field Goal', columns=['x', 'y'], chunksize=70)
+    keys = [key for key, _ in dataset.iter_plays()]
+
+    expected = [key for key, event in play_events(data_dir).items() if event == EVENTS['Field Goal']]
+    assert keys == expected
+
+def test_get_play_missing(data_dir):
+    dataset = TrackingDataset(data_dir, seasons=SEASONS)
+
+    assert get_play(1, 1, dataset).empty